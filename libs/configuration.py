@@ -78,6 +78,19 @@ class BaseConfig(configparser.RawConfigParser):
             pass
 
 
+    def setStorageDefaults(self):
+        """ Set default SQLite PRAGMAs of the database in section storage, empty value for SQLite default.
+            WAL journal does not work on network filesystems, so it must be enabled explicitly.
+        """
+        self.defaults["storage"] = {}
+        self.defaults["storage"]["journal_mode"] = "delete"
+        self.defaults["storage"]["synchronous"] = "full"
+        self.defaults["storage"]["cache_size"] = "-16000"
+        self.defaults["storage"]["mmap_size"] = "0"
+        self.defaults["storage"]["temp_store"] = "memory"
+        self.defaults["storage"]["busy_timeout"] = "5000"
+
+
     def update(self, section, option, prompt, validate=None):
         """ Update option via user input.
         """
@@ -88,12 +101,28 @@ class BaseConfig(configparser.RawConfigParser):
 
 
 
+class GlobalConfig(BaseConfig):
+    def __init__(self, configFile):
+        BaseConfig.__init__(self, configFile)
+        self.log = logging.getLogger("Pyggs.GlobalConfig")
+
+        # SQLite PRAGMAs of the global database shared by all profiles
+        self.setStorageDefaults()
+
+
+
 class ProfileConfig(BaseConfig):
     def __init__(self, configFile):
         BaseConfig.__init__(self, configFile)
         self.log = logging.getLogger("Pyggs.ProfileConfig")
 
         # set default values
+        self.defaults["geocaching.com"] = {}
+        self.defaults["geocaching.com"]["cachesize"] = "50"
+        # Number of processes parsing cache pages, 1 to parse in the main process, 0 for the number of CPUs
+        self.defaults["geocaching.com"]["processes"] = "1"
+        # SQLite PRAGMAs of the profile database
+        self.setStorageDefaults()
         self.defaults["output"] = {}
         self.defaults["output"]["template"] = "default.en"
         self.defaults["output"]["theme"] = "default"
@@ -5,21 +5,33 @@ Parsing geocaching.com website.
 Classes:
     HTTPInterface       --- Interface retrieving/sending data directly.
                             from/to geocaching.com website.
+    ConnectionPool      --- Pool of persistent HTTP/1.1 connections.
+    ResponseCache       --- On-disk cache of HTTP responses.
+    DecompressHandler   --- URL handler decoding gzip/deflate responses.
+    FixtureArchive      --- Archive of recorded HTTP responses for offline replay.
+    RequestPool         --- Pool of worker threads for concurrent requests.
+    PendingRequest      --- Result of a request queued in RequestPool.
+    TokenBucket         --- Token bucket rate limiter with shared state.
+    RetryPolicy         --- Retry policy with backoff and circuit breaker.
+    RequestMetrics      --- Per-request metrics aggregated by URL class.
     BaseParser          --- Define common parts for all parsers.
     CacheDetails        --- Parse cache details from webpage source.
+    CacheDetailsResult  --- Mapping with cache details parsed on demand.
     MyGeocachingLogs    --- Parse and filter the list of my logs from webpage source.
     SeekCache           --- Parse caches in seek query from webpage source.
     SeekCacheOCR        --- Improved version of SeekCache, which also parses direction,
                             distance, difficulty, terrain and size of caches in the list.
     SeekResult          --- Sequence wrapper for a result of seek query with lazy loading of next pages.
+    SeekStore           --- SQLite file with caches and paging state of seek results.
+    OCRCache            --- Persistent cache of OCR results of seek images.
     Profile             --- Manage user's profile.
-    ImageDownloader     --- Thread for downloading images.
     Image               --- Basic image manipulation.
     Credentials         --- Named tuple for representing credentails.
     CacheLog            --- Named tuple for representing log from cache listing.
     LogItem             --- Named tuple for representing a log from user's profile'.
     CredentialsError    --- Raised on invalid credentials.
     LoginError          --- Raised when geocaching.com login fails.
+    DownloadError       --- Raised when a download fails permanently.
 
 """
 
@@ -29,42 +41,76 @@ __license__ = "LGPL 3.0"
 
 __version__ = "0.7.9"
 
-from collections import defaultdict, namedtuple, Sequence, Callable
+import atexit
+from collections import defaultdict, deque, namedtuple, Mapping, OrderedDict, Sequence, Callable
 from datetime import date, datetime, timedelta
+import email.parser
 from hashlib import md5
 from html.parser import HTMLParser
 from http.cookiejar import CookieJar, LWPCookieJar
+import http.client
+import io
 import json
 import logging
+import multiprocessing
 import os
 import os.path
-from random import randint
+import queue
+from random import randint, uniform
 import re
+import socket
+import sqlite3
+import ssl
+import struct
 import subprocess
 import threading
 from time import time, sleep
 import unicodedata
+import urllib.error
 import urllib.parse
 import urllib.request
+import urllib.response
+import zlib
 
 import png
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
 
 __all__ = ["HTTPInterface",
+           "ConnectionPool",
+           "ResponseCache",
+           "DecompressHandler",
+           "FixtureArchive",
+           "RequestPool",
+           "PendingRequest",
+           "TokenBucket",
+           "RetryPolicy",
+           "RequestMetrics",
            "BaseParser",
            "CacheDetails",
+           "CacheDetailsResult",
            "MyGeocachingLogs",
            "SeekCache",
            "SeekCacheOCR",
            "SeekResult",
+           "SeekStore",
+           "OCRCache",
            "Profile",
-           "ImageDownloader",
            "Image",
            "Credentials",
            "CacheLog",
            "LogItem",
            "CredentialsError",
-           "LoginError"]
+           "LoginError",
+           "DownloadError"]
 
 
 ############################################################
@@ -87,6 +133,14 @@ class LoginError(AssertionError):
     pass
 
 
+class DownloadError(IOError):
+    """
+    Raised when a download fails permanently.
+
+    """
+    pass
+
+
 
 ############################################################
 ### Data containers & design patterns                    ###
@@ -148,6 +202,976 @@ class HTTPRedirectHandler(urllib.request.HTTPRedirectHandler):
         return urllib.request.HTTPRedirectHandler.http_error_302(self, req, fp, code, msg, headers)
 
 
+class ConnectionPool:
+    """
+    Pool of persistent HTTP/1.1 connections, shared by all URL openers.
+
+    Attributes:
+        max_idle    --- Maximum number of idle connections kept per host.
+        stats       --- Dictionary with counts of requests, opened and reused
+                        connections.
+
+    Methods:
+        get         --- Get idle connection to the host, or create a new one.
+        put         --- Return connection to the pool for later reuse.
+        close       --- Close all idle connections.
+
+    """
+
+    def __init__(self, max_idle=4):
+        """
+        Keyworded arguments:
+            max_idle    --- Maximum number of idle connections kept per host.
+
+        """
+        self._log = logging.getLogger("gcparser.http.pool")
+        self._lock = threading.Lock()
+        self._idle = defaultdict(list)
+        self.max_idle = max_idle
+        self.stats = defaultdict(int)
+
+    def get(self, scheme, host, timeout):
+        """
+        Get idle connection to the host, or create a new one. Returns tuple
+        (connection, reused).
+
+        Arguments:
+            scheme      --- URL scheme, 'http' or 'https'.
+            host        --- Host name (with optional port).
+            timeout     --- Socket timeout for a new connection.
+
+        """
+        key = (scheme, host)
+        with self._lock:
+            self.stats["requests"] += 1
+            if len(self._idle[key]) > 0:
+                self.stats["reused"] += 1
+                self._log.debug("Reusing connection to {0}://{1} ({2}/{3} requests on reused connections).".format(scheme, host, self.stats["reused"], self.stats["requests"]))
+                return self._idle[key].pop(), True
+            self.stats["opened"] += 1
+        self._log.debug("Opening new connection to {0}://{1}.".format(scheme, host))
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, timeout=timeout)
+        else:
+            conn = http.client.HTTPConnection(host, timeout=timeout)
+        return conn, False
+
+    def put(self, scheme, host, conn):
+        """
+        Return connection to the pool for later reuse.
+
+        Arguments:
+            scheme      --- URL scheme, 'http' or 'https'.
+            host        --- Host name (with optional port).
+            conn        --- HTTPConnection instance.
+
+        """
+        key = (scheme, host)
+        with self._lock:
+            if len(self._idle[key]) < self.max_idle:
+                self._idle[key].append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """
+        Close all idle connections.
+
+        """
+        with self._lock:
+            for key in self._idle:
+                for conn in self._idle[key]:
+                    conn.close()
+            self._idle.clear()
+
+
+class KeepAliveHandler(urllib.request.HTTPHandler, urllib.request.HTTPSHandler):
+    """
+    Replace urllib.request.HTTPHandler and HTTPSHandler by handler sending the
+    requests over persistent connections from ConnectionPool.
+    """
+
+    def __init__(self, pool, metrics=None):
+        urllib.request.AbstractHTTPHandler.__init__(self)
+        self.pool = pool
+        self.metrics = metrics
+
+    https_request = urllib.request.AbstractHTTPHandler.do_request_
+
+    def http_open(self, req):
+        return self._open("http", req)
+
+    def https_open(self, req):
+        return self._open("https", req)
+
+    def _open(self, scheme, req):
+        host = req.host
+        if not host:
+            raise urllib.error.URLError("no host given")
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items() if k not in headers))
+        headers["Connection"] = "keep-alive"
+        headers = dict((name.title(), value) for name, value in headers.items())
+        while True:
+            conn, reused = self.pool.get(scheme, host, req.timeout)
+            try:
+                if not reused and self.metrics is not None:
+                    self._connect(conn)
+                start = time()
+                conn.request(req.get_method(), req.selector, req.data, headers)
+                response = conn.getresponse()
+                body = response.read()
+                if self.metrics is not None:
+                    self.metrics.add("transfer", time() - start)
+                    self.metrics.add("bytes", len(body))
+            except (socket.error, http.client.HTTPException) as e:
+                conn.close()
+                if reused and req.get_method() in ("GET", "HEAD"):
+                    # The server has probably closed idle connection, try another one.
+                    # Other requests are not retried, they might have been already processed.
+                    continue
+                raise urllib.error.URLError(e)
+            break
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool.put(scheme, host, conn)
+        result = urllib.response.addinfourl(io.BytesIO(body), response.msg, req.get_full_url(), response.status)
+        result.msg = response.reason
+        return result
+
+    def _connect(self, conn):
+        """ Open new connection to the host resolved once, measure name resolution and connect time. """
+        start = time()
+        addresses = socket.getaddrinfo(conn.host, conn.port, 0, socket.SOCK_STREAM)
+        resolved = time()
+        for i, address in enumerate(addresses):
+            try:
+                sock = socket.create_connection(address[4][:2], conn.timeout)
+                break
+            except socket.error:
+                if i == len(addresses) - 1:
+                    raise
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if isinstance(conn, http.client.HTTPSConnection):
+            if hasattr(conn, "_context"):
+                sock = conn._context.wrap_socket(sock, server_hostname=conn.host)
+            else:
+                sock = ssl.wrap_socket(sock, conn.key_file, conn.cert_file)
+        conn.sock = sock
+        self.metrics.add("dns", resolved - start)
+        self.metrics.add("connect", time() - resolved)
+
+
+class ResponseCache:
+    """
+    On-disk cache of HTTP responses, revalidated by conditional GET requests.
+
+    Attributes:
+        directory   --- Directory with cached responses.
+        max_size    --- Maximum total size of cached bodies in bytes, least
+                        recently used entries are evicted first.
+        stats       --- Dictionary with counts of stored, revalidated and
+                        evicted entries.
+
+    Methods:
+        key         --- Return cache key for URL and auth identity.
+        get         --- Return validators of cached response.
+        load        --- Return body of cached response.
+        store       --- Store response body with its validators.
+        remove      --- Remove cached response.
+
+    """
+
+    def __init__(self, directory, max_size):
+        """
+        Arguments:
+            directory   --- Directory for storing cached responses.
+            max_size    --- Maximum total size of cached bodies in bytes.
+
+        """
+        self._log = logging.getLogger("gcparser.http.cache")
+        self._lock = threading.Lock()
+        self.directory = directory
+        self.max_size = max_size
+        self.stats = defaultdict(int)
+        if not os.path.isdir(directory):
+            os.mkdir(directory)
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(".body"):
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        entries.sort()
+        self._index = OrderedDict()
+        self._size = 0
+        for mtime, key, size in entries:
+            self._index[key] = size
+            self._size += size
+        self._evict()
+
+    def key(self, url, identity=None):
+        """
+        Return cache key for URL and auth identity.
+
+        Arguments:
+            url         --- Requested URL.
+
+        Keyworded arguments:
+            identity    --- Username used for authentication, or None.
+
+        """
+        return md5("{0}\n{1}".format(identity or "", url).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Return dictionary with validators (etag, last_modified) of cached response,
+        or None if there is no cached response or its body is missing.
+
+        Arguments:
+            key         --- Cache key.
+
+        """
+        with self._lock:
+            if key not in self._index:
+                return None
+        try:
+            if not os.path.isfile(self._file(key, "body")):
+                raise IOError("Missing body.")
+            with open(self._file(key, "meta"), "r", encoding="utf-8") as fp:
+                return json.load(fp)
+        except (IOError, ValueError):
+            self._log.warn("Invalid cache entry {0}, removing.".format(key))
+            with self._lock:
+                self._remove(key)
+            return None
+
+    def load(self, key):
+        """
+        Return body of cached response, or None.
+
+        Arguments:
+            key         --- Cache key.
+
+        """
+        with self._lock:
+            if key not in self._index:
+                return None
+            # Mark as recently used.
+            self._index[key] = self._index.pop(key)
+        try:
+            with open(self._file(key, "body"), "rb") as fp:
+                body = fp.read()
+            os.utime(self._file(key, "body"), None)
+        except IOError:
+            self._log.warn("Invalid cache entry {0}, removing.".format(key))
+            with self._lock:
+                self._remove(key)
+            return None
+        self.stats["revalidated"] += 1
+        return body
+
+    def store(self, key, url, body, etag=None, last_modified=None):
+        """
+        Store response body with its validators.
+
+        Arguments:
+            key             --- Cache key.
+            url             --- Requested URL.
+            body            --- Response body (bytes).
+
+        Keyworded arguments:
+            etag            --- Value of ETag header.
+            last_modified   --- Value of Last-Modified header.
+
+        """
+        if len(body) > self.max_size:
+            return
+        meta = {"url":url, "etag":etag, "last_modified":last_modified}
+        with self._lock:
+            self._remove(key)
+            try:
+                with open(self._file(key, "body"), "wb") as fp:
+                    fp.write(body)
+                with open(self._file(key, "meta"), "w", encoding="utf-8") as fp:
+                    json.dump(meta, fp)
+            except IOError:
+                self._log.error("Could not store cache entry for '{0}'.".format(url))
+                self._remove(key)
+                return
+            self._index[key] = len(body)
+            self._size += len(body)
+            self.stats["stored"] += 1
+            self._evict()
+
+    def remove(self, key):
+        """
+        Remove cached response.
+
+        Arguments:
+            key         --- Cache key.
+
+        """
+        with self._lock:
+            self._remove(key)
+
+    def _file(self, key, kind):
+        return os.path.join(self.directory, "{0}.{1}".format(key, kind))
+
+    def _remove(self, key):
+        """ Remove entry from index and disk, lock must be held. """
+        self._size -= self._index.pop(key, 0)
+        for kind in ("body", "meta"):
+            if os.path.isfile(self._file(key, kind)):
+                os.remove(self._file(key, kind))
+
+    def _evict(self):
+        """ Evict least recently used entries over max_size, lock must be held. """
+        while self._size > self.max_size and len(self._index) > 0:
+            key = next(iter(self._index))
+            self._log.debug("Evicting cache entry {0}.".format(key))
+            self._remove(key)
+            self.stats["evicted"] += 1
+
+
+class CacheHandler(urllib.request.BaseHandler):
+    """
+    Add conditional headers to GET requests with a cached response and serve the
+    cached body when the server replies 304 Not Modified. Responses marked by
+    Cache-Control as no-store or private are not cached.
+    """
+
+    # Process responses before HTTPErrorProcessor raises HTTPError on 304.
+    handler_order = 900
+
+    def __init__(self, cache, identity=None):
+        self.cache = cache
+        self.identity = identity
+
+    def http_request(self, req):
+        if req.data is None:
+            entry = self.cache.get(self.cache.key(req.get_full_url(), self.identity))
+            if entry is not None:
+                if entry.get("etag"):
+                    req.add_unredirected_header("If-None-Match", entry["etag"])
+                if entry.get("last_modified"):
+                    req.add_unredirected_header("If-Modified-Since", entry["last_modified"])
+        return req
+
+    https_request = http_request
+
+    def http_response(self, req, response):
+        if req.data is not None:
+            return response
+        url = req.get_full_url()
+        key = self.cache.key(url, self.identity)
+        if response.code == 304:
+            body = self.cache.load(key)
+            if body is None:
+                # The cached body disappeared meanwhile, request the page again unconditionally.
+                logging.getLogger("gcparser.http.cache").debug("Cached copy of page '{0}' is missing, downloading again.".format(url))
+                self.cache.remove(key)
+                # Conditional headers are unredirected, so they are not copied.
+                retry = urllib.request.Request(url, headers=dict(req.headers))
+                return self.parent.open(retry, timeout=req.timeout)
+            logging.getLogger("gcparser.http.cache").debug("Page '{0}' not modified, using cached copy.".format(url))
+            result = urllib.response.addinfourl(io.BytesIO(body), response.info(), url, 200)
+            result.msg = "OK"
+            result.from_cache = True
+            return result
+        if response.code == 200:
+            cache_control = [token.split("=")[0].strip().lower() for token in response.info().get("Cache-Control", "").split(",")]
+            if "no-store" in cache_control or "private" in cache_control:
+                self.cache.remove(key)
+                return response
+            etag = response.info().get("ETag")
+            last_modified = response.info().get("Last-Modified")
+            if etag is not None or last_modified is not None:
+                body = response.read()
+                self.cache.store(key, url, body, etag=etag, last_modified=last_modified)
+                result = urllib.response.addinfourl(io.BytesIO(body), response.info(), url, response.code)
+                result.msg = response.msg
+                return result
+        return response
+
+    https_response = http_response
+
+
+class DecompressHandler(urllib.request.BaseHandler):
+    """
+    Negotiate gzip/deflate transfer encoding and transparently decode the
+    responses.
+
+    Attributes:
+        traffic     --- Dictionary with total count of received (compressed)
+                        and decompressed bytes.
+
+    """
+
+    # Decode responses before CacheHandler stores them.
+    handler_order = 800
+
+    traffic = defaultdict(int)
+    _lock = threading.Lock()
+
+    def http_request(self, req):
+        if not req.has_header("Accept-encoding"):
+            req.add_unredirected_header("Accept-Encoding", "gzip, deflate")
+        return req
+
+    https_request = http_request
+
+    def http_response(self, req, response):
+        headers = response.info()
+        encoding = (headers.get("Content-Encoding") or "identity").strip().lower()
+        if encoding not in ("gzip", "x-gzip", "deflate"):
+            return response
+        body = response.read()
+        try:
+            if encoding == "deflate":
+                try:
+                    data = zlib.decompress(body)
+                except zlib.error:
+                    # Some servers send raw deflate stream without zlib header.
+                    data = zlib.decompress(body, -zlib.MAX_WBITS)
+            else:
+                data = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        except zlib.error as e:
+            raise urllib.error.URLError("Invalid {0} encoded response: {1}".format(encoding, e))
+        logging.getLogger("gcparser.http").debug("Received {0} bytes, {1} bytes decompressed ({2}).".format(len(body), len(data), encoding))
+        with self._lock:
+            self.traffic["compressed"] += len(body)
+            self.traffic["decompressed"] += len(data)
+        del headers["Content-Encoding"]
+        del headers["Content-Length"]
+        headers["Content-Length"] = str(len(data))
+        result = urllib.response.addinfourl(io.BytesIO(data), headers, response.geturl(), response.code)
+        result.msg = response.msg
+        return result
+
+    https_response = http_response
+
+
+class FixtureArchive:
+    """
+    Local archive of recorded HTTP responses for offline replay. Repeated
+    requests are recorded in sequence and replayed in the same order.
+
+    Attributes:
+        directory   --- Directory with recorded responses.
+        mode        --- 'record' or 'replay'.
+
+    Methods:
+        handlers    --- Return URL handlers recording/replaying the responses.
+        load        --- Return recorded response for the request.
+        store       --- Record response for the request.
+
+    """
+
+    def __init__(self, directory, mode):
+        """
+        Arguments:
+            directory   --- Directory with recorded responses.
+            mode        --- 'record' or 'replay'.
+
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError("Invalid fixture mode '{0}'.".format(mode))
+        self._log = logging.getLogger("gcparser.http.fixtures")
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self.directory = os.path.expanduser(directory)
+        self.mode = mode
+        if mode == "record" and not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def handlers(self):
+        """
+        Return list of URL handlers recording/replaying the responses.
+
+        """
+        if self.mode == "replay":
+            return [FixtureReplayHandler(self)]
+        else:
+            return [FixtureRecordHandler(self)]
+
+    def _key(self, req):
+        """ Return key of the request and its sequence number. """
+        data = req.data or bytes()
+        key = md5(req.get_method().encode("utf-8") + b"\n" + req.get_full_url().encode("utf-8") + b"\n" + data).hexdigest()
+        with self._lock:
+            seq = self._counters[key]
+            self._counters[key] += 1
+        return key, seq
+
+    def _file(self, key, seq, kind):
+        """ Return path to the file of recorded response. """
+        return os.path.join(self.directory, "{0}.{1}.{2}".format(key, seq, kind))
+
+    def load(self, req):
+        """
+        Return recorded response for the request, or raise DownloadError.
+
+        Arguments:
+            req         --- urllib.request.Request instance.
+
+        """
+        key, seq = self._key(req)
+        # Replay the last recorded response, when the request was repeated more times.
+        while seq > 0 and not os.path.isfile(self._file(key, seq, "json")):
+            seq -= 1
+        try:
+            with open(self._file(key, seq, "json"), "r", encoding="utf-8") as fp:
+                meta = json.load(fp)
+            with open(self._file(key, seq, "body"), "rb") as fp:
+                body = fp.read()
+        except (IOError, ValueError):
+            raise DownloadError("No recorded response for '{0}'.".format(req.get_full_url()))
+        self._log.debug("Replaying response for '{0}'.".format(req.get_full_url()))
+        headers = email.parser.Parser(_class=http.client.HTTPMessage).parsestr(meta["headers"])
+        result = urllib.response.addinfourl(io.BytesIO(body), headers, meta["url"], meta["code"])
+        result.msg = meta["msg"]
+        return result
+
+    def store(self, req, response, body):
+        """
+        Record response for the request.
+
+        Arguments:
+            req         --- urllib.request.Request instance.
+            response    --- Response object.
+            body        --- Response body (bytes).
+
+        """
+        key, seq = self._key(req)
+        data = None
+        if req.data is not None:
+            data = urllib.parse.parse_qsl(req.data.decode("utf-8", "replace"), keep_blank_values=True)
+            # Do not store passwords in plain text.
+            data = [(name, "***" if _pcre("password_field").search(name) else value) for name, value in data]
+        meta = {"url":response.geturl(), "method":req.get_method(), "data":data, "code":response.code, "msg":response.msg, "headers":str(response.info())}
+        try:
+            with open(self._file(key, seq, "body"), "wb") as fp:
+                fp.write(body)
+            with open(self._file(key, seq, "json"), "w", encoding="utf-8") as fp:
+                json.dump(meta, fp)
+        except IOError:
+            self._log.error("Could not record response for '{0}'.".format(req.get_full_url()))
+
+
+class FixtureReplayHandler(urllib.request.BaseHandler):
+    """
+    Serve recorded responses from FixtureArchive instead of the network.
+    """
+
+    # Open before any network handler.
+    handler_order = 100
+
+    def __init__(self, archive):
+        self.archive = archive
+
+    def http_open(self, req):
+        return self.archive.load(req)
+
+    https_open = http_open
+
+
+class FixtureRecordHandler(urllib.request.BaseHandler):
+    """
+    Record final responses (after decoding and cache revalidation) to
+    FixtureArchive.
+    """
+
+    # Record after CacheHandler, but before HTTPErrorProcessor.
+    handler_order = 950
+
+    def __init__(self, archive):
+        self.archive = archive
+
+    def http_response(self, req, response):
+        body = response.read()
+        self.archive.store(req, response, body)
+        result = urllib.response.addinfourl(io.BytesIO(body), response.info(), response.geturl(), response.code)
+        result.msg = response.msg
+        result.from_cache = getattr(response, "from_cache", False)
+        return result
+
+    https_response = http_response
+
+
+def _lock_file(fp):
+    """ Acquire exclusive lock of an open file (blocking). """
+    if fcntl is not None:
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+    elif msvcrt is not None:
+        fp.seek(0)
+        msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(fp):
+    """ Release lock of an open file. """
+    if fcntl is not None:
+        fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        fp.seek(0)
+        msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. When state_file is given, the state is shared
+    through the file (protected by a file lock) by all processes using it.
+
+    Without pace, a token taken from the empty bucket waits for the refill.
+    With pace, tokens taken from the empty bucket are spaced by pace seconds
+    instead, and the bucket goes into debt, which must be refilled before the
+    next burst.
+
+    Attributes:
+        rate        --- Number of tokens added per second.
+        capacity    --- Maximum number of tokens (size of a burst).
+        pace        --- Time between tokens taken from the empty bucket, or None.
+        state_file  --- Path to the file with shared state, or None.
+
+    Methods:
+        acquire     --- Take one token and return number of seconds to wait
+                        before using it.
+        refund      --- Give one token back.
+
+    """
+
+    def __init__(self, rate, capacity, pace=None, state_file=None, clock=time):
+        """
+        Arguments:
+            rate        --- Number of tokens added per second.
+            capacity    --- Maximum number of tokens.
+
+        Keyworded arguments:
+            pace        --- Time between tokens taken from the empty bucket.
+            state_file  --- Path to the file with shared state.
+            clock       --- Function returning current time in seconds.
+
+        """
+        self._log = logging.getLogger("gcparser.http.TokenBucket")
+        self._lock = threading.Lock()
+        self._clock = clock
+        self.rate = rate
+        self.capacity = capacity
+        self.pace = pace
+        self.state_file = state_file
+        self._tokens = float(capacity)
+        self._timestamp = clock()
+        # Time, when the next token from the empty bucket can be used.
+        self._next = 0.0
+
+    def acquire(self):
+        """
+        Take one token and return number of seconds to wait before using it. The
+        token is reserved even when the bucket is empty, so the waits of
+        consecutive calls add up.
+
+        """
+        with self._lock:
+            return self._update(-1)
+
+    def refund(self):
+        """
+        Give one token back.
+
+        """
+        with self._lock:
+            self._update(1)
+
+    def _update(self, change):
+        """ Refill the bucket and apply change of tokens, return wait time. """
+        if self.state_file is None:
+            return self._apply(change)
+        try:
+            with open(self.state_file, "a+", encoding="utf-8") as fp:
+                _lock_file(fp)
+                try:
+                    fp.seek(0)
+                    state = fp.read().split("\t")
+                    if len(state) >= 2:
+                        self._tokens = float(state[0])
+                        self._timestamp = float(state[1])
+                        self._next = float(state[2]) if len(state) >= 3 else 0.0
+                    wait = self._apply(change)
+                    fp.seek(0)
+                    fp.truncate()
+                    fp.write("{0!r}\t{1!r}\t{2!r}".format(self._tokens, self._timestamp, self._next))
+                    fp.flush()
+                finally:
+                    _unlock_file(fp)
+        except (IOError, ValueError):
+            self._log.error("Could not use shared rate limiter state '{0}'.".format(self.state_file))
+            wait = self._apply(change)
+        return wait
+
+    def _apply(self, change):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + max(0, now - self._timestamp) * self.rate)
+        self._timestamp = max(now, self._timestamp)
+        self._tokens = min(self.capacity, self._tokens + change)
+        if self._tokens >= 0 and change < 0:
+            return 0
+        if self.pace is None:
+            return max(0, -self._tokens / self.rate)
+        if change > 0:
+            if self._tokens <= 0:
+                # Give back the time slot of the refunded token.
+                self._next = max(now, self._next - self.pace)
+            return 0
+        start = max(now, self._next)
+        self._next = start + self.pace
+        return start - now
+
+
+class RetryPolicy:
+    """
+    Policy for retrying failed downloads: bounded number of attempts,
+    exponential backoff with jitter and a per-host circuit breaker. After
+    breaker_threshold consecutive failures on a host the breaker opens and the
+    downloads from the host fail fast for breaker_timeout seconds; then a
+    single attempt is let through to probe the host again.
+
+    Attributes:
+        max_attempts        --- Maximum number of attempts for one download.
+        backoff             --- Wait time before the first retry in seconds.
+        max_backoff         --- Maximum wait time before a retry in seconds.
+        jitter              --- Relative random deviation of the wait time.
+        breaker_threshold   --- Number of consecutive failures opening the breaker.
+        breaker_timeout     --- Number of seconds the open breaker fails fast.
+        stats               --- Dictionary with counts of retries, failures and
+                                rejected downloads.
+
+    Methods:
+        delay       --- Return wait time before the retry.
+        allow       --- Check if a download from the host may be attempted.
+        success     --- Record successful download from the host.
+        failure     --- Record failed download from the host.
+
+    """
+
+    def __init__(self, max_attempts=5, backoff=2, max_backoff=300, jitter=0.25, breaker_threshold=10, breaker_timeout=600, clock=time):
+        self._log = logging.getLogger("gcparser.http.RetryPolicy")
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._failures = defaultdict(int)
+        self._opened = {}
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+        self.stats = defaultdict(int)
+
+    def delay(self, attempt):
+        """
+        Return wait time before the retry.
+
+        Arguments:
+            attempt     --- Number of failed attempts so far.
+
+        """
+        delay = min(self.max_backoff, self.backoff * 2**(attempt-1))
+        return max(0, delay * (1 + uniform(-self.jitter, self.jitter)))
+
+    def allow(self, host):
+        """
+        Check if a download from the host may be attempted.
+
+        Arguments:
+            host        --- Host name.
+
+        """
+        with self._lock:
+            if host not in self._opened:
+                return True
+            if self._clock() >= self._opened[host]:
+                # Half-open: let one attempt through, next failure re-opens the breaker.
+                self._log.info("Probing {0} again after failures.".format(host))
+                self._opened[host] = self._clock() + self.breaker_timeout
+                return True
+            self.stats["rejected"] += 1
+            return False
+
+    def success(self, host):
+        """
+        Record successful download from the host.
+
+        Arguments:
+            host        --- Host name.
+
+        """
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened.pop(host, None)
+
+    def failure(self, host):
+        """
+        Record failed download from the host.
+
+        Arguments:
+            host        --- Host name.
+
+        """
+        with self._lock:
+            self.stats["failures"] += 1
+            self._failures[host] += 1
+            if self._failures[host] >= self.breaker_threshold:
+                if host not in self._opened:
+                    self._log.error("Too many failures on {0}, failing fast for {1} seconds.".format(host, self.breaker_timeout))
+                self._opened[host] = self._clock() + self.breaker_timeout
+
+
+class RequestMetrics:
+    """
+    Per-request metrics (bytes, DNS/connect/transfer time, wait time, retries,
+    re-logins) aggregated by URL class. Records are kept per thread, so
+    concurrent requests do not mix.
+
+    Attributes:
+        classes     --- List of (class name, URL regexp), first match wins.
+        buckets     --- Upper bounds of histogram buckets in seconds.
+
+    Methods:
+        begin       --- Start record of a request.
+        current     --- Return record of the request in progress.
+        add         --- Add value to the record of the request in progress.
+        end         --- Finish record of the request in progress.
+        summary     --- Return dictionary with aggregated metrics.
+        write       --- Write JSON summary to a file.
+
+    """
+
+    classes = [("cache_details", "/seek/cache_details\.aspx"),
+               ("logs", "/my/logs\.aspx"),
+               ("seek", "/seek/nearest\.aspx"),
+               ("image", "/ImgGen/|\.(png|gif|jpe?g)(\?|$)"),
+               ("login", "/login/"),
+               ("gccz", "geocaching\.cz"),
+               ("geonames", "geonames\.org")]
+    buckets = [0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120]
+
+    _fields = ["bytes", "size", "dns", "connect", "transfer", "wait", "retries", "relogin", "from_cache", "errors"]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._classes = [(name, re.compile(mask, re.I)) for name, mask in self.classes]
+        self._started = time()
+        self._totals = {}
+
+    def _classify(self, url):
+        """ Return URL class of the url. """
+        for name, mask in self._classes:
+            if mask.search(url):
+                return name
+        return "other"
+
+    def begin(self, url):
+        """
+        Start record of a request, records may be nested (e.g. re-login in the
+        middle of a request).
+
+        Arguments:
+            url         --- Requested URL.
+
+        """
+        record = dict((field, 0) for field in self._fields)
+        record["url"] = url
+        record["start"] = time()
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        self._local.stack.append(record)
+        return record
+
+    def current(self, url=None):
+        """
+        Return record of the request in progress in this thread, or None.
+
+        Keyworded arguments:
+            url         --- Return the record only if it is for this URL.
+
+        """
+        stack = getattr(self._local, "stack", None)
+        if not stack or (url is not None and stack[-1]["url"] != url):
+            return None
+        return stack[-1]
+
+    def add(self, field, value):
+        """
+        Add value to the record of the request in progress, if there is any.
+
+        Arguments:
+            field       --- Name of the metric.
+            value       --- Value to add.
+
+        """
+        record = self.current()
+        if record is not None:
+            record[field] += value
+
+    def end(self):
+        """
+        Finish record of the request in progress and add it to the summary.
+
+        """
+        record = self._local.stack.pop()
+        total = time() - record["start"]
+        url_class = self._classify(record["url"])
+        with self._lock:
+            if url_class not in self._totals:
+                totals = dict((field, 0) for field in self._fields)
+                totals["count"] = 0
+                totals["total"] = 0
+                totals["histograms"] = dict((name, [0]*(len(self.buckets)+1)) for name in ("total", "wait", "transfer"))
+                self._totals[url_class] = totals
+            totals = self._totals[url_class]
+            totals["count"] += 1
+            totals["total"] += total
+            for field in self._fields:
+                totals[field] += record[field]
+            for name, value in (("total", total), ("wait", record["wait"]), ("transfer", record["transfer"])):
+                totals["histograms"][name][self._bucket(value)] += 1
+
+    def _bucket(self, value):
+        """ Return index of histogram bucket for the value. """
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                return index
+        return len(self.buckets)
+
+    def summary(self):
+        """
+        Return dictionary with aggregated metrics by URL class.
+
+        """
+        labels = ["<={0}".format(bound) for bound in self.buckets] + [">{0}".format(self.buckets[-1])]
+        result = {"elapsed":time() - self._started, "classes":{}}
+        with self._lock:
+            for url_class, totals in self._totals.items():
+                totals = dict(totals)
+                totals["histograms"] = dict((name, OrderedDict(zip(labels, counts))) for name, counts in totals["histograms"].items())
+                result["classes"][url_class] = totals
+        for field in ("count", "bytes", "wait", "transfer"):
+            result[field] = sum(totals[field] for totals in result["classes"].values())
+        return result
+
+    def write(self, filename):
+        """
+        Write JSON summary to a file.
+
+        Arguments:
+            filename    --- Output file.
+
+        """
+        with open(filename, "w", encoding="utf-8") as fp:
+            json.dump(self.summary(), fp, indent=2)
+
+
 class HTTPInterface(StaticClass):
     """
     Interface retrieving/sending data directly from/to geocaching.com website.
@@ -155,14 +1179,30 @@ class HTTPInterface(StaticClass):
 
     Attributes:
         stats            --- Dictionary with download stats of pages with auth=True.
-        request_avg_time --- Desired average request sleep time for pages with
-                             auth=True.
+        request_avg_time --- Desired average time between requests for pages
+                             with auth=True, once the burst is used up.
+        request_burst    --- Number of pages with auth=True, that can be
+                             downloaded without slowing down.
+        request_recovery --- Time to regain one page of the burst, pages over
+                             the burst must be regained too.
+        request_interval --- Minimal time between any two requests.
+        retry_policy     --- RetryPolicy used by download_url.
+        flush_interval   --- Minimal time between writes of cookies and stats
+                             to the disk.
+        fixtures         --- FixtureArchive recording/replaying responses, or None.
+        metrics          --- RequestMetrics collecting per-request metrics.
+        pool             --- ConnectionPool shared by all URL openers.
+        cache            --- ResponseCache instance, or None if disabled.
+        cache_size       --- Maximum size of response cache in bytes.
 
     Methods:
         set_credentials --- Set credentials to use for geocaching.com login.
         get_data_dir    --- Get data directory.
         set_data_dir    --- Set data directory for for storing cookies,
                             user_agent, download stats...
+        set_cache_size  --- Set maximum size of response cache.
+        set_fixtures    --- Record responses to, or replay them from local archive.
+        flush           --- Write buffered cookies and stats to the disk.
         request         --- Retrive/send data from/to geocaching.com website.
         build_opener    --- Build URL opener.
         download_url    --- Download data from URL.
@@ -177,11 +1217,25 @@ class HTTPInterface(StaticClass):
     _cookies = None
     _user_agent = None
     _last_download = 0
-    _first_download = 0
-    _download_count = 0
+    _bucket = None
+    _cookies_dirty = False
+    _stats_pending = defaultdict(int)
+    _last_flush = 0
+    _local = threading.local()
+    _lock = threading.RLock()
 
     stats = defaultdict(int)
-    request_avg_time = 600
+    request_avg_time = 50
+    request_burst = 50
+    request_recovery = 600
+    request_interval = 1
+    retry_policy = RetryPolicy()
+    flush_interval = 30
+    fixtures = None
+    metrics = RequestMetrics()
+    pool = ConnectionPool()
+    cache = None
+    cache_size = 50*1024*1024
 
     @classmethod
     def set_credentials(cls, credentials):
@@ -196,8 +1250,10 @@ class HTTPInterface(StaticClass):
             raise CredentialsError("Credentials must be an instance of Credentials.")
         if credentials.username is None or credentials.password is None:
             cls._log.warn("No geocaching.com credentials given, some features won't be accessible.")
+        cls.flush()
         cls._credentials = credentials
         cls._load_stats()
+        cls._bucket = None
 
     @classmethod
     def get_data_dir(cls, data_dir=None):
@@ -217,6 +1273,7 @@ class HTTPInterface(StaticClass):
                             home directory)
 
         """
+        cls.flush()
         if data_dir is None:
             cls._log.warn("No data directory provided, caching will be disabled.")
             cls._data_dir = None
@@ -229,6 +1286,66 @@ class HTTPInterface(StaticClass):
                 cls._log.warn("Data directory '{0}' does not exist, caching will be disabled.".format(data_dir))
                 cls._data_dir = None
         cls._load_stats()
+        cls._bucket = None
+        cls._init_cache()
+
+    @classmethod
+    def set_cache_size(cls, cache_size):
+        """
+        Set maximum size of response cache.
+
+        Arguments:
+            cache_size  --- Maximum size in bytes, 0 disables the cache.
+
+        """
+        cls.cache_size = cache_size
+        cls._init_cache()
+
+    @classmethod
+    def set_fixtures(cls, directory, mode):
+        """
+        Record all responses to a local archive, or replay them from it without
+        touching the network (wait() does not sleep in replay mode).
+
+        Arguments:
+            directory   --- Archive directory, or None to disable.
+            mode        --- 'record' or 'replay'.
+
+        """
+        if directory is None:
+            cls.fixtures = None
+        else:
+            cls._log.info("Using fixtures in '{0}' ({1} mode).".format(directory, mode))
+            cls.fixtures = FixtureArchive(directory, mode)
+
+    @classmethod
+    def flush(cls):
+        """
+        Write buffered cookies and download stats to the disk. Called
+        periodically from request(), and automatically at exit.
+
+        """
+        with cls._lock:
+            if cls._cookies_dirty:
+                cls._save_cookies()
+                cls._cookies_dirty = False
+            if cls._stats_pending:
+                cls._save_stats()
+                cls._stats_pending.clear()
+            cls._last_flush = time()
+
+    @classmethod
+    def _init_cache(cls):
+        """ (Re)create response cache in data directory. """
+        if cls._data_dir is None or cls.cache_size <= 0:
+            cls.cache = None
+            return
+        cache_dir = os.path.join(cls._data_dir, "http_cache")
+        try:
+            cls.cache = ResponseCache(cache_dir, cls.cache_size)
+        except (IOError, OSError):
+            cls._log.warn("Could not create response cache in '{0}', caching will be disabled.".format(cache_dir))
+            cls.cache = None
 
     @classmethod
     def request(cls, url, auth=False, data=None, check=True):
@@ -244,17 +1361,37 @@ class HTTPInterface(StaticClass):
             check       --- Re-check if we're logged in after download.
 
         """
+        cls.metrics.begin(url)
+        try:
+            return cls._request(url, auth, data, check)
+        finally:
+            cls.metrics.end()
+
+    @classmethod
+    def _request(cls, url, auth, data, check):
+        """ Retrive/send data, metrics record of the request is already open. """
         opener = cls.build_opener(auth)
         cls.wait(auth)
         webpage = cls.download_url(opener, url, data).decode("utf-8")
         if auth:
-            cls._save_cookies()
-            today = date.today().isoformat()
-            cls.stats[today] += 1
-            cls._save_stats()
+            with cls._lock:
+                if getattr(cls._local, "from_cache", False):
+                    # Not modified page is cheap for the server, give the download back.
+                    cls._get_bucket().refund()
+                cls._cookies_dirty = True
+                today = date.today().isoformat()
+                cls.stats[today] += 1
+                cls._stats_pending[today] += 1
+                if time() - cls._last_flush >= cls.flush_interval:
+                    cls.flush()
         if auth and check and not cls._check_login(webpage):
             cls._log.debug("We're not actually logged in, refreshing login and redownloading page.")
-            cls._login()
+            cls.metrics.add("relogin", 1)
+            if cls.cache is not None:
+                # The page for not logged in user must not be served from the cache later.
+                cls.cache.remove(cls.cache.key(url, cls._credentials.username))
+            with cls._lock:
+                cls._login()
             return cls.request(url, auth=auth, data=data)
         return webpage
 
@@ -267,11 +1404,17 @@ class HTTPInterface(StaticClass):
             auth        --- Authenticate before request.
 
         """
+        handlers = [HTTPRedirectHandler, KeepAliveHandler(cls.pool, cls.metrics), DecompressHandler]
         if auth:
-            cookies = cls._get_cookies()
-            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookies), HTTPRedirectHandler)
-        else:
-            opener = urllib.request.build_opener(HTTPRedirectHandler)
+            with cls._lock:
+                cookies = cls._get_cookies()
+            handlers.append(urllib.request.HTTPCookieProcessor(cookies))
+        if cls.cache is not None:
+            identity = cls._credentials.username if auth else None
+            handlers.append(CacheHandler(cls.cache, identity))
+        if cls.fixtures is not None:
+            handlers.extend(cls.fixtures.handlers())
+        opener = urllib.request.build_opener(*handlers)
         headers = []
         headers.append(("User-agent", cls._get_user_agent()))
         headers.append(("Accept", "text/xml,application/xml,application/xhtml+xml,text/html;q=0.9,text/plain;q=0.8"))
@@ -281,9 +1424,11 @@ class HTTPInterface(StaticClass):
         return opener
 
     @classmethod
-    def download_url(cls, opener, url, data=None, retryTime=1):
+    def download_url(cls, opener, url, data=None):
         """
-        Download data from URL.
+        Download data from URL, retry failed downloads according to retry_policy.
+        Raises DownloadError when all attempts fail, or when the circuit breaker
+        for the host is open.
 
         Arguments:
             opener      --- Opener instance.
@@ -291,21 +1436,62 @@ class HTTPInterface(StaticClass):
 
         Keyworded arguments:
             data        --- POST data.
-            retryTime   --- Number of seconds to wait before retry when download fails.
 
         """
-        cls._log.debug("Downloading page '{0}'.".format(url))
+        if cls.metrics.current(url) is not None:
+            return cls._download_url(opener, url, data)
+        # Direct download (e.g. images), not going through request().
+        cls.metrics.begin(url)
         try:
-            if data is not None:
-                response = opener.open(url, urllib.parse.urlencode(data).encode("utf-8"))
+            return cls._download_url(opener, url, data)
+        finally:
+            cls.metrics.end()
+
+    @classmethod
+    def _download_url(cls, opener, url, data=None):
+        """ Download data from URL, metrics record of the request is already open. """
+        policy = cls.retry_policy
+        host = urllib.parse.urlsplit(url)[1]
+        attempt = 0
+        while True:
+            if not policy.allow(host):
+                cls.metrics.add("errors", 1)
+                raise DownloadError("Too many failures on {0}, not downloading '{1}'.".format(host, url))
+            attempt += 1
+            cls._log.debug("Downloading page '{0}'.".format(url))
+            try:
+                if data is not None:
+                    response = opener.open(url, urllib.parse.urlencode(data).encode("utf-8"))
+                else:
+                    response = opener.open(url)
+                cls._local.from_cache = getattr(response, "from_cache", False)
+                response = response.read()
+                cls.metrics.add("from_cache", int(cls._local.from_cache))
+                cls.metrics.add("size", len(response))
+            except DownloadError:
+                cls.metrics.add("errors", 1)
+                raise
+            except urllib.error.HTTPError as e:
+                if e.code < 500:
+                    # Client error, the host is fine but retrying won't help.
+                    policy.success(host)
+                    cls.metrics.add("errors", 1)
+                    raise DownloadError("Could not download '{0}': {1}.".format(url, e))
+                error = e
+            except IOError as e:
+                error = e
             else:
-                response = opener.open(url)
-            response = response.read()
-        except IOError:
-            cls._log.error("An error occured while downloading '{0}', will retry in {1} seconds.".format(url, retryTime))
-            sleep(retryTime)
-            return cls.download_url(opener, url, data, retryTime=min(5*retryTime, 600))
-        return response
+                policy.success(host)
+                return response
+            policy.failure(host)
+            if attempt >= policy.max_attempts:
+                cls.metrics.add("errors", 1)
+                raise DownloadError("Could not download '{0}' in {1} attempts: {2}.".format(url, attempt, error))
+            delay = policy.delay(attempt)
+            policy.stats["retries"] += 1
+            cls.metrics.add("retries", 1)
+            cls._log.error("An error occured while downloading '{0}', will retry in {1:.0f} seconds.".format(url, delay))
+            sleep(delay)
 
     @classmethod
     def _user_file_name(cls):
@@ -409,8 +1595,9 @@ class HTTPInterface(StaticClass):
 
     @classmethod
     def _load_stats(cls):
-        """ Load download stats from file. """
+        """ Load download stats from journal file and compact it. """
         cls.stats = defaultdict(int)
+        cls._stats_pending.clear()
         user_file = cls._user_file_name()
         if user_file is None:
             return
@@ -418,30 +1605,45 @@ class HTTPInterface(StaticClass):
         if os.path.isfile(stats_file):
             today = date.today()
             timeout = today - timedelta(days=93)
-            with open(stats_file, "r", encoding="utf-8") as fp:
+            with open(stats_file, "r+", encoding="utf-8") as fp:
                 cls._log.debug("Loading stats.")
-                for line in fp.readlines():
-                    line = line.strip()
-                    if not line:
-                        continue
-                    line = line.split("\t")
-                    download_date = line[0].split("-")
-                    download_date = date(int(download_date[0]), int(download_date[1]), int(download_date[2]))
-                    download_count = int(line[1])
-                    if download_date > timeout:
-                        cls.stats[download_date.isoformat()] = download_count
+                _lock_file(fp)
+                try:
+                    # The journal holds increments, sum them up.
+                    for line in fp.readlines():
+                        line = line.strip()
+                        if not line:
+                            continue
+                        line = line.split("\t")
+                        download_date = line[0].split("-")
+                        download_date = date(int(download_date[0]), int(download_date[1]), int(download_date[2]))
+                        download_count = int(line[1])
+                        if download_date > timeout:
+                            cls.stats[download_date.isoformat()] += download_count
+                    fp.seek(0)
+                    fp.truncate()
+                    for download_date, download_count in sorted(cls.stats.items()):
+                        fp.write("{0}\t{1}\n".format(download_date, download_count))
+                finally:
+                    fp.flush()
+                    _unlock_file(fp)
 
     @classmethod
     def _save_stats(cls):
-        """ Try to save stats, if possible. """
+        """ Try to append pending stats to the journal, if possible. """
         user_file = cls._user_file_name()
         if user_file is None:
             return
         stats_file = user_file + ".stats"
-        with open(stats_file, "w", encoding="utf-8") as fp:
+        with open(stats_file, "a", encoding="utf-8") as fp:
             cls._log.debug("Saving stats.")
-            for download_date, download_count in cls.stats.items():
-                fp.write("{0}\t{1}\n".format(download_date, download_count))
+            _lock_file(fp)
+            try:
+                for download_date, download_count in cls._stats_pending.items():
+                    fp.write("{0}\t{1}\n".format(download_date, download_count))
+            finally:
+                fp.flush()
+                _unlock_file(fp)
 
     @classmethod
     def _login(cls):
@@ -452,6 +1654,9 @@ class HTTPInterface(StaticClass):
                 cls._log.critical("Login error.")
                 raise LoginError("Cannot log in.")
         cls._log.debug("Logged in.")
+        # Fresh session cookies are worth saving right away.
+        cls._cookies_dirty = True
+        cls.flush()
 
     @classmethod
     def _login_attempt(cls):
@@ -493,35 +1698,210 @@ class HTTPInterface(StaticClass):
             auth        --- Is this for a page where autentication is needed?
 
         """
-        if not auth:
-            sleep_time = 1
-        else:
-            # No request for a long time => reset _first_download value using desired average.
-            cls._first_download = max(time() - cls._download_count * cls.request_avg_time, cls._first_download)
-            # Calculate number of downloaded pages ahead of expected average
-            count = cls._download_count - int((time() - cls._first_download) / cls.request_avg_time)
-            # sleep time 1s: 10/10s => overall 10/10s
-            if count < 10:
-                sleep_time = 1
-            # sleep time 2-8s: 40/3.3m => overall 50/3.5min
-            elif count < 50:
-                sleep_time = randint(2, 8)
-            # sleep time 5-35s: 155/51.6m => overall 205/55.1min
-            elif count < 200:
-                sleep_time = randint(5, 35)
-            # sleep time 10-50s: 315/2.6h => overall 520/3.5h
-            elif count < 500:
-                sleep_time = randint(10, 50)
-            # sleep time 20-80s
-            else:
-                sleep_time = randint(20, 80)
-            cls._download_count += 1
-        cls._log.debug("Waiting for {0} seconds.".format(sleep_time))
-        sleep(max(0, cls._last_download + sleep_time - time()))
-        cls._last_download = time()
+        if cls.fixtures is not None and cls.fixtures.mode == "replay":
+            return
+        delay = 0
+        if auth:
+            # Pages beyond the burst are paced by the shared token bucket.
+            delay = cls._get_bucket().acquire()
+        with cls._lock:
+            # Reserve the time slot, so the concurrent requests are spaced too.
+            start = max(time() + delay, cls._last_download + cls.request_interval)
+            cls._last_download = start
+        delay = max(0, start - time())
+        cls._log.debug("Waiting for {0:.1f} seconds.".format(delay))
+        cls.metrics.add("wait", delay)
+        sleep(delay)
+
+    @classmethod
+    def _get_bucket(cls):
+        """ Return token bucket shared by all processes using the same credentials. """
+        with cls._lock:
+            if cls._bucket is None:
+                user_file = cls._user_file_name()
+                if user_file is None:
+                    state_file = None
+                else:
+                    state_file = user_file + ".bucket"
+                cls._bucket = TokenBucket(1.0/cls.request_recovery, cls.request_burst, pace=cls.request_avg_time, state_file=state_file)
+            else:
+                cls._bucket.rate = 1.0/cls.request_recovery
+                cls._bucket.capacity = cls.request_burst
+                cls._bucket.pace = cls.request_avg_time
+            return cls._bucket
+
+
+HTTPInterface.set_data_dir("~/.geocaching/parser")
+atexit.register(HTTPInterface.flush)
+
+
+class PendingRequest:
+    """
+    Result of a request queued in RequestPool.
+
+    Methods:
+        done        --- Return True if the request is finished.
+        result      --- Wait for the request and return its result.
+
+    """
+
+    def __init__(self, function, args, kwargs):
+        self._function = function
+        self._args = args
+        self._kwargs = kwargs
+        self._finished = threading.Event()
+        self._result = None
+        self._error = None
+
+    def _run(self):
+        try:
+            self._result = self._function(*self._args, **self._kwargs)
+        except Exception as e:
+            self._error = e
+        # Do not keep the caller (e.g. bound method) alive.
+        self._function = self._args = self._kwargs = None
+        self._finished.set()
+
+    def done(self):
+        """
+        Return True if the request is finished.
+
+        """
+        return self._finished.is_set()
+
+    def result(self):
+        """
+        Wait for the request and return its result, or re-raise its exception.
+
+        """
+        self._finished.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class RequestPool:
+    """
+    Pool of worker threads keeping several HTTPInterface requests in flight.
+    Every request still goes through HTTPInterface.wait, so the throughput is
+    limited by the politeness policy and not by the round-trip latency.
+
+    Attributes:
+        workers         --- Number of worker threads.
+
+    Methods:
+        submit          --- Queue a call in the pool.
+        request         --- Perform HTTPInterface.request in the pool and wait
+                            for the result.
+        map             --- Yield results of requests for several URLs in order.
+        iter_pending    --- Yield pending requests for several URLs in order.
+        close           --- Stop worker threads.
+
+    """
+
+    def __init__(self, workers=4, http=HTTPInterface):
+        """
+        Keyworded arguments:
+            workers     --- Number of worker threads.
+            http        --- HTTP interface object.
+
+        """
+        self._log = logging.getLogger("gcparser.http.RequestPool")
+        self._queue = queue.Queue()
+        self._threads = []
+        self.http = http
+        self.workers = max(1, workers)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            pending = self._queue.get()
+            if pending is None:
+                break
+            pending._run()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queue a call in the pool and return PendingRequest instance.
+
+        Arguments:
+            function    --- Callable to run in a worker thread.
+            *args       --- Positional arguments for the callable.
+            **kwargs    --- Keyworded arguments for the callable.
+
+        """
+        pending = PendingRequest(function, args, kwargs)
+        self._queue.put(pending)
+        return pending
+
+    def request(self, url, auth=False, data=None, check=True):
+        """
+        Perform HTTPInterface.request in the pool and wait for the result.
+
+        Arguments:
+            url         --- Webpage URL.
+
+        Keyworded arguments:
+            auth        --- Authenticate before request.
+            data        --- Data to send with request.
+            check       --- Re-check if we're logged in after download.
+
+        """
+        return self.submit(self.http.request, url, auth=auth, data=data, check=check).result()
+
+    def map(self, urls, auth=False):
+        """
+        Yield downloaded webpages for the sequence of URLs in the same order,
+        keeping at most twice the number of workers requests ahead.
+
+        Arguments:
+            urls        --- Iterable of webpage URLs.
+
+        Keyworded arguments:
+            auth        --- Authenticate before request.
+
+        """
+        for pending in self.iter_pending(urls, auth=auth):
+            yield pending.result()
+
+    def iter_pending(self, urls, auth=False):
+        """
+        Like map, but yield PendingRequest instances, so the caller can handle
+        failure of every request separately.
+
+        Arguments:
+            urls        --- Iterable of webpage URLs.
+
+        Keyworded arguments:
+            auth        --- Authenticate before request.
+
+        """
+        pending = deque()
+        for url in urls:
+            pending.append(self.submit(self.http.request, url, auth=auth))
+            if len(pending) >= 2*self.workers:
+                yield pending.popleft()
+        while len(pending) > 0:
+            yield pending.popleft()
+
+    def close(self, wait=True):
+        """
+        Stop worker threads after all queued requests are finished.
 
+        Keyworded arguments:
+            wait        --- Wait for the threads to finish.
 
-HTTPInterface.set_data_dir("~/.geocaching/parser")
+        """
+        for thread in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
 
 
 
@@ -580,11 +1960,49 @@ def _pcre(name):
         _pcres[name] = re.compile(*_pcre_masks[name])
     return _pcres[name]
 
+_scan_literals = {}
+_scan_folding = {0x130:"i", 0x131:"i", 0x17f:"s", 0x212a:"k"}
+
+def _scan(data, names):
+    """
+    Find the first match of each of the named PCREs in data, returns dictionary
+    name => match object (or None). Groups of the matches are the same as of
+    _pcre(name).search(data), but the page is lowercased only once, PCREs which
+    cannot match (a literal required by them is missing) are not run at all,
+    and the others are run from the first occurence of the literal every match
+    starts with. See _scan_literals.
+    """
+    if any(chr(char) in data for char in _scan_folding):
+        # Non-ASCII characters matching ASCII letters in case insensitive PCRE.
+        lowered = data.translate(_scan_folding)
+    else:
+        lowered = data
+    # Lowercasing of bytes is much faster and touches only ASCII letters.
+    lowered = lowered.encode("utf-8").lower()
+    starts = {}
+    found = {}
+    for name in names:
+        prefix, required = _scan_literals[name]
+        if required not in lowered:
+            found[name] = None
+            continue
+        if prefix not in starts:
+            start = lowered.find(prefix)
+            if start > 0:
+                start = len(lowered[:start].decode("utf-8"))
+            starts[prefix] = start
+        if starts[prefix] < 0:
+            found[name] = None
+        else:
+            found[name] = _pcre(name).search(data, starts[prefix])
+    return found
+
 ########################################
 # PCRE: System.                        #
 ########################################
 _pcre_masks["null"] = (".*", 0)
 _pcre_masks["file_mask"] = ("[^a-zA-Z0-9._-]+", re.A)
+_pcre_masks["password_field"] = ("password|^p$", re.I)
 
 ########################################
 # PCRE: HTML.                        #
@@ -631,7 +2049,9 @@ class BaseParser:
 
     def __init__(self):
         if hasattr(self, "_log"):
-            self._log.log_parser = lambda x: self._log.log(LOG_PARSER, x)
+            # Bind to the (shared) logger, not to the parser, so the logger does not keep the parser alive.
+            log = self._log
+            log.log_parser = lambda x: log.log(LOG_PARSER, x)
 
 
 ########################################
@@ -714,6 +2134,31 @@ _pcre_masks["cache_visits"] = ("<span id=['\"]ctl00_ContentBody_lblFindCounts['\
 _pcre_masks["cache_log_count"] = ("<img[^>]*alt=\"([^\"]+)\"[^>]*/>\s*([0-9,]+)", re.I)
 _pcre_masks["cache_logs"] = ("//<!\[CDATA\[\s*\ninitalLogs = (.*);\s*\n//]]>", re.I)
 
+# Lowercase literals (prefix, required) for _scan: every match of the PCRE starts
+# with prefix and contains required.
+_scan_literals["waypoint"] = (b"gc", b"gc")
+_scan_literals["PMonly"] = (b"<img ", b"premium members only")
+_scan_literals["PMowner"] = (b"<span", b"a cache by ")
+# Leading \s* of PMsize only moves the start of the match, the groups are the same.
+_scan_literals["PMsize"] = (b"<img ", b"size: ")
+_scan_literals["PMdifficulty"] = (b"<strong>", b"difficulty:</span></strong>")
+_scan_literals["PMterrain"] = (b"<strong>", b"terrain:</span></strong>")
+_scan_literals["PMcache_type"] = (b"<img id=", b"ctl00_contentbody_uxwpttypeimage")
+_scan_literals["cache_pm"] = (b"<p class=", b"this is a premium member only cache.</p>")
+_scan_literals["cache_favorites"] = (b"<span class=", b"favorite-value")
+_scan_literals["cache_details"] = (b"<meta", b" was created by ")
+_scan_literals["cache_type"] = (b"<img src=", b"/images/wpttypes/")
+_scan_literals["cache_owner_id"] = (b"by <a href=", b"/profile/?guid=")
+_scan_literals["disabled"] = (b"<p class=", b"<strong>cache issues:</strong></p><ul")
+_scan_literals["cache_coords"] = (b"<span id=", b"uxlatlon")
+_scan_literals["cache_shortDesc"] = (b"<div class=", b"ctl00_contentbody_shortdescription")
+_scan_literals["cache_longDesc"] = (b"<div class=", b"ctl00_contentbody_longdescription")
+_scan_literals["cache_hint"] = (b"<div id=", b"div_hint")
+_scan_literals["cache_attributes"] = (b"attributes", b"what are attributes?</a></small></p>")
+_scan_literals["cache_inventory"] = (b"<span", b"ctl00_contentbody_uxtravelbuglist_uxinventorylabel\">inventory</span>")
+_scan_literals["cache_visits"] = (b"<span id=", b"ctl00_contentbody_lblfindcounts")
+_scan_literals["cache_logs"] = (b"//<![cdata[", b"initallogs = ")
+
 
 class CacheDetails(BaseParser):
     """
@@ -721,93 +2166,204 @@ class CacheDetails(BaseParser):
 
     Attributes:
         logs        --- Whether to return complete list of logs by default.
+        workers     --- Number of concurrent downloads in get_many.
+        processes   --- Number of worker processes parsing the pages in
+                        get_many, None for the number of CPUs, 1 to parse
+                        in the calling process.
+        min_batch   --- Minimal number of caches in get_many to use the
+                        worker processes.
 
     Methods:
-        get         --- Get cache details as dictionary by guid or waypoint.
+        get         --- Get cache details as CacheDetailsResult by guid or
+                        waypoint.
+        get_many    --- Get details of several caches, downloading the pages
+                        concurrently.
+        start       --- Start the worker processes.
+        close       --- Stop the worker processes.
 
     """
 
     _url = "http://www.geocaching.com/seek/cache_details.aspx?decrypt=y"
 
     logs = False
+    workers = 4
+    processes = 1
+    min_batch = 20
 
     def __init__(self):
         self._log = logging.getLogger("gcparser.parser.CacheDetails")
         BaseParser.__init__(self)
+        self._process_pool = None
+
+    def start(self):
+        """
+        Start the worker processes (if processes is not 1), they are reused by
+        all calls of get_many until close. Call this before starting any other
+        threads, the workers are forked from the calling process.
+
+        """
+        if self.processes != 1 and self._process_pool is None:
+            self._process_pool = multiprocessing.Pool(self.processes)
+
+    def close(self):
+        """
+        Stop the worker processes.
+
+        """
+        if self._process_pool is not None:
+            self._process_pool.terminate()
+            self._process_pool.join()
+            self._process_pool = None
 
-    def get(self, id_):
+    def get(self, id_, fields=None):
         """
-        Get cache details by guid or waypoint.
+        Get cache details by guid or waypoint. Returns CacheDetailsResult
+        mapping, the expensive fields (descriptions, inventory and logs) are
+        parsed only when accessed.
 
         Arguments:
             id_         --- Geocache waypoint or guid.
 
+        Keyworded arguments:
+            fields      --- Sequence of the fields to return, None for all.
+
+        """
+        data = self.http.request(self._page_url(id_), auth=True)
+        return self._parse(data, id_, fields)
+
+    def get_many(self, ids, fields=None):
+        """
+        Get details of several caches by guid or waypoint, downloading the pages
+        concurrently. Yields the details in the same order as ids, caches which
+        could not be downloaded are skipped.
+
+        Batches of at least min_batch caches are parsed in the worker processes
+        (started by start, or on the first such batch), the lazy fields are
+        parsed in the worker too, so pass only the fields you need.
+
+        Arguments:
+            ids         --- Sequence of geocache waypoints or guids.
+
+        Keyworded arguments:
+            fields      --- Sequence of the fields to return, None for all.
+
         """
+        ids = list(ids)
+        processes = None
+        if self.processes != 1 and len(ids) >= self.min_batch:
+            # Fork before starting the download threads, unless already started.
+            self.start()
+            processes = self._process_pool
+        pool = RequestPool(min(self.workers, len(ids)), self.http)
+        try:
+            failure = []
+            pages = self._iter_pages(ids, pool.iter_pending((self._page_url(id_) for id_ in ids), auth=True), failure)
+            if processes is not None:
+                for details in processes.imap(_parse_cache_details, ((data, id_, fields) for data, id_ in pages)):
+                    yield CacheDetailsResult(details, {})
+            else:
+                for data, id_ in pages:
+                    yield self._parse(data, id_, fields)
+            if len(failure) > 0:
+                raise failure[0]
+        finally:
+            pool.close()
+
+    def _iter_pages(self, ids, pending, failure):
+        """ Yield (data, id_) of downloaded pages, store unexpected exception in failure and stop. """
+        for id_, page in zip(ids, pending):
+            try:
+                data = page.result()
+            except DownloadError as e:
+                self._log.error("Could not get details of cache {0}: {1}".format(id_, e))
+                continue
+            except Exception as e:
+                # The pages may be consumed by the feeder thread of the process pool, re-raise in the caller.
+                failure.append(e)
+                return
+            yield data, id_
+
+    def _page_url(self, id_):
+        """ Return URL of cache details page. """
+        if _pcre("guid").match(id_) is not None:
+            type_ = "guid"
+        else:
+            type_ = "wp"
+        return self._url + "&{0}={1}".format(type_, id_)
+
+    _fields = ["PMonly", "cache_pm", "cache_details", "cache_type", "cache_owner_id", "disabled", "cache_favorites", "cache_coords", "cache_shortDesc", "cache_longDesc", "cache_hint", "cache_attributes", "cache_inventory", "cache_visits", "cache_logs"]
+    _PMfields = ["PMowner", "PMsize", "PMdifficulty", "PMterrain", "PMcache_type"]
+
+    def _parse(self, data, id_, fields=None):
+        """ Parse cache details from webpage source. """
         if _pcre("guid").match(id_) is not None:
             type_ = "guid"
         else:
             type_ = "wp"
-        url = self._url + "&{0}={1}".format(type_, id_)
-        data = self.http.request(url, auth=True)
+        url = self._page_url(id_)
 
         details = {}
+        lazy = {}
         if type_ == "wp":
+            found = _scan(data, self._fields)
             details["waypoint"] = id_
         else:
+            found = _scan(data, self._fields + ["waypoint"])
             details["guid"] = id_
-            match = _pcre("waypoint").search(data)
+            match = found["waypoint"]
             if match is not None:
                 details["waypoint"] = match.group(0)
                 self._log.log_parser("waypoint = {0}".format(details["waypoint"]))
             else:
                 self._log.error("Waypoint not found.")
 
-        match = _pcre("PMonly").search(data)
+        match = found["PMonly"]
         if match is not None:
+            found.update(_scan(data, self._PMfields))
             details["PMonly"] = True
             self._log.warn("PM only cache at '{0}'.".format(url))
 
             details["name"] = _unescape(match.group(1)).strip()
             self._log.log_parser("name = {0}".format(details["name"]))
 
-            match = _pcre("PMowner").search(data)
+            match = found["PMowner"]
             if match is not None:
                 details["owner"] = _unescape(match.group(1)).strip()
                 self._log.log_parser("owner = {0}".format(details["owner"]))
             else:
                 self._log.error("Could not parse cache owner.")
 
-            match = _pcre("PMsize").search(data)
+            match = found["PMsize"]
             if match is not None:
                 details["size"] = match.group(1).strip()
                 self._log.log_parser("size = {0}".format(details["size"]))
             else:
                 self._log.error("Could not parse cache size.")
 
-            match = _pcre("PMdifficulty").search(data)
+            match = found["PMdifficulty"]
             if match is not None:
                 details["difficulty"] = float(match.group(1))
                 self._log.log_parser("difficulty = {0:.1f}".format(details["difficulty"]))
             else:
                 self._log.error("Could not parse cache difficulty.")
 
-            match = _pcre("PMterrain").search(data)
+            match = found["PMterrain"]
             if match is not None:
                 details["terrain"] = float(match.group(1))
                 self._log.log_parser("terrain = {0:.1f}".format(details["terrain"]))
             else:
                 self._log.error("Could not parse cache terrain.")
 
-            match = _pcre("PMcache_type").search(data)
+            match = found["PMcache_type"]
             if match is not None and match.group(1) in _cache_types:
                 details["type"] = _cache_types[match.group(1)]
                 self._log.log_parser("type = {0}".format(details["type"]))
             else:
                 self._log.error("Type not found.")
         else:
-            details["PMonly"] = _pcre("cache_pm").search(data) is not None
+            details["PMonly"] = found["cache_pm"] is not None
 
-            match = _pcre("cache_details").search(data)
+            match = found["cache_details"]
             if match is not None:
                 details["name"] = _unescape(_unescape(match.group(1))).strip()
                 details["owner"] = _unescape(_unescape(match.group(2))).strip()
@@ -831,7 +2387,7 @@ class CacheDetails(BaseParser):
             else:
                 self._log.error("Could not parse cache details.")
 
-            match = _pcre("cache_type").search(data)
+            match = found["cache_type"]
             if match is not None:
                 details["type"] = _unescape(match.group(2)).strip()
                 # GS weird changes bug
@@ -841,7 +2397,7 @@ class CacheDetails(BaseParser):
             else:
                 self._log.error("Type not found.")
 
-            match = _pcre("cache_owner_id").search(data)
+            match = found["cache_owner_id"]
             if match is not None:
                 details["owner_id"] = match.group(1)
                 details["guid"] = match.group(2)
@@ -854,7 +2410,7 @@ class CacheDetails(BaseParser):
 
             details["disabled"] = 0
             details["archived"] = 0
-            match = _pcre("disabled").search(data)
+            match = found["disabled"]
             if match is not None:
                 if match.group(1) == "has been archived":
                     details["archived"] = 1
@@ -862,14 +2418,14 @@ class CacheDetails(BaseParser):
                 self._log.log_parser("archived = {0}".format(details["archived"]))
                 self._log.log_parser("disabled = {0}".format(details["disabled"]))
 
-            match = _pcre("cache_favorites").search(data)
+            match = found["cache_favorites"]
             if match is not None:
                 details["favorites"] = int(match.group(1))
                 self._log.log_parser("favorites = {0}".format(details["favorites"]))
             else:
                 self._log.error("Favorites count not found.")
 
-            match = _pcre("cache_coords").search(data)
+            match = found["cache_coords"]
             if match is not None:
                 details["lat"] = float(match.group(2)) + float(match.group(3))/60
                 if match.group(1) == "S":
@@ -882,32 +2438,17 @@ class CacheDetails(BaseParser):
             else:
                 self._log.error("Lat, lon not found.")
 
-            match = _pcre("cache_shortDesc").search(data)
-            if match is not None:
-                details["shortDescHTML"] = match.group(1)
-                details["shortDesc"] = _clean_HTML(match.group(1))
-                self._log.log_parser("shortDesc = {0}...".format(details["shortDesc"].replace("\n"," ")[0:50]))
-            else:
-                details["shortDescHTML"] = ""
-                details["shortDesc"] = ""
-
-            match = _pcre("cache_longDesc").search(data)
-            if match is not None:
-                details["longDescHTML"] = match.group(1)
-                details["longDesc"] = _clean_HTML(match.group(1))
-                self._log.log_parser("longDesc = {0}...".format(details["longDesc"].replace("\n"," ")[0:50]))
-            else:
-                details["longDescHTML"] = ""
-                details["longDesc"] = ""
+            lazy["shortDesc"] = lambda: self._parse_desc("shortDesc", found["cache_shortDesc"])
+            lazy["longDesc"] = lambda: self._parse_desc("longDesc", found["cache_longDesc"])
 
-            match = _pcre("cache_hint").search(data)
+            match = found["cache_hint"]
             if match is not None:
                 details["hint"] = _unescape(match.group(1).replace("<br>", "\n")).strip()
                 self._log.log_parser("hint = {0}...".format(details["hint"].replace("\n"," ")[0:50]))
             else:
                 details["hint"] = ""
 
-            match = _pcre("cache_attributes").search(data)
+            match = found["cache_attributes"]
             if match is not None:
                 details["attributes"] = []
                 for item in _pcre("cache_attributes_item").finditer(match.group(1)):
@@ -919,17 +2460,10 @@ class CacheDetails(BaseParser):
             else:
                 details["attributes"] = ""
 
-            details["inventory"] = {}
-            match = _pcre("cache_inventory").search(data)
-            if match is not None:
-                for part in match.group(1).split("</li>"):
-                    match = _pcre("cache_inventory_item").search(part)
-                    if match is not None:
-                        details["inventory"][match.group(1)] = _unescape(match.group(2)).strip()
-                self._log.log_parser("inventory = {0}".format(details["inventory"]))
+            lazy["inventory"] = lambda: self._parse_inventory(found["cache_inventory"])
 
             details["visits"] = {}
-            match = _pcre("cache_visits").search(data)
+            match = found["cache_visits"]
             if match is not None:
                 for part in match.group(1).split("&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;"):
                     match = _pcre("cache_log_count").search(part)
@@ -937,17 +2471,106 @@ class CacheDetails(BaseParser):
                         details["visits"][_unescape(match.group(1)).strip()] = int(match.group(2).replace(",", ""))
                 self._log.log_parser("visits = {0}".format(details["visits"]))
 
-            details["logs"] = []
-            match = _pcre("cache_logs").search(data)
-            if match is not None:
-                for row in json.loads(match.group(1))["data"]:
-                    m, d, y = row["Visited"].split("/")
-                    log_date = "{0:04d}-{1:02d}-{2:02d}".format(int(y), int(m), int(d))
-                    details["logs"].append(CacheLog(row["LogGuid"], row["LogType"], log_date, _unescape(row["UserName"]), row["AccountGuid"], _clean_HTML(row["LogText"])))
-                self._log.log_parser("Found {0} logs.".format(len(details["logs"])))
+            lazy["logs"] = lambda: self._parse_logs(found["cache_logs"])
+
+        return CacheDetailsResult(details, lazy, fields)
 
+    def _parse_desc(self, name, match):
+        """ Parse short or long description. """
+        details = {}
+        if match is not None:
+            details[name + "HTML"] = match.group(1)
+            details[name] = _clean_HTML(match.group(1))
+            self._log.log_parser("{0} = {1}...".format(name, details[name].replace("\n"," ")[0:50]))
+        else:
+            details[name + "HTML"] = ""
+            details[name] = ""
         return details
 
+    def _parse_inventory(self, match):
+        """ Parse cache inventory. """
+        inventory = {}
+        if match is not None:
+            for part in match.group(1).split("</li>"):
+                match = _pcre("cache_inventory_item").search(part)
+                if match is not None:
+                    inventory[match.group(1)] = _unescape(match.group(2)).strip()
+            self._log.log_parser("inventory = {0}".format(inventory))
+        return {"inventory":inventory}
+
+    def _parse_logs(self, match):
+        """ Parse logs from the JSON in the page. """
+        logs = []
+        if match is not None:
+            for row in json.loads(match.group(1))["data"]:
+                m, d, y = row["Visited"].split("/")
+                log_date = "{0:04d}-{1:02d}-{2:02d}".format(int(y), int(m), int(d))
+                logs.append(CacheLog(row["LogGuid"], row["LogType"], log_date, _unescape(row["UserName"]), row["AccountGuid"], _clean_HTML(row["LogText"])))
+            self._log.log_parser("Found {0} logs.".format(len(logs)))
+        return {"logs":logs}
+
+
+def _parse_cache_details(args):
+    """ Parse cache details page in a worker process, returns dictionary with all the fields. """
+    data, id_, fields = args
+    return dict(CacheDetails()._parse(data, id_, fields))
+
+
+class CacheDetailsResult(Mapping):
+    """
+    Read-only mapping with cache details, the expensive fields are parsed on
+    the first access.
+
+    """
+
+    # Fields set by each of the lazy loaders.
+    _lazy_fields = {"shortDesc":("shortDescHTML", "shortDesc"),
+                    "longDesc":("longDescHTML", "longDesc"),
+                    "inventory":("inventory",),
+                    "logs":("logs",)}
+
+    def __init__(self, details, loaders, fields=None):
+        """
+        Arguments:
+            details     --- Dictionary with already parsed fields.
+            loaders     --- Dictionary name => function returning dictionary
+                            with fields, see _lazy_fields.
+
+        Keyworded arguments:
+            fields      --- Sequence of the fields to keep, None for all.
+
+        """
+        self._details = dict(details)
+        self._loaders = {}
+        for name, loader in loaders.items():
+            for field in self._lazy_fields[name]:
+                if fields is None or field in fields:
+                    self._loaders[field] = loader
+        if fields is not None:
+            for field in list(self._details.keys()):
+                if field not in fields:
+                    del self._details[field]
+
+    def __getitem__(self, key):
+        if key not in self._details and key in self._loaders:
+            for field, value in self._loaders[key]().items():
+                if field in self._loaders:
+                    del self._loaders[field]
+                    self._details[field] = value
+        return self._details[key]
+
+    def __contains__(self, key):
+        return key in self._details or key in self._loaders
+
+    def __iter__(self):
+        return iter(list(self._details.keys()) + list(self._loaders.keys()))
+
+    def __len__(self):
+        return len(self._details) + len(self._loaders)
+
+    def __repr__(self):
+        return "<CacheDetailsResult {0}>".format(sorted(self))
+
 
 ########################################
 # MyGeocachingLogs                     #
@@ -972,6 +2595,8 @@ class CacheDetails(BaseParser):
 #<a href="http://www.geocaching.com/seek/log.aspx?LUID=af2e28fa-e12e-4d2b-b6b1-64a2441996e3" target="_blank" title="Visit Log">Visit Log</a>
 #</td>
 #</tr>
+# Same as <tr[^>]*>.*?</tr> with re.S, but without trying to match </tr> at every character.
+_pcre_masks["logs_row"] = ("<tr[^>]*>[^<]*(?:<(?!/tr>)[^<]*)*</tr>", re.I)
 _pcre_masks["logs_item"] = ("<tr[^>]*>\s*<td[^>]*>\s*<img [^>]*alt=\"([^\"]+)\"[^>]*>\s*</td>\s*<td[^>]*>.*?</td>\s*<td[^>]*>\s*([0-9]+)/([0-9]+)/([0-9]+)\s*</td>\s*<td[^>]*>\s*((<span[^>]*>)?<a[^>]*>)?\s*<img src=['\"](http://www\.geocaching\.com)?/images/wpttypes/[^'\"]+['\"][^>]*title=\"([^\"]+)\"[^>]*>\s*(</a>)?\s*<a href=['\"](http://www\.geocaching\.com)?/seek/cache_details.aspx\?guid=([a-z0-9-]+)['\"][^>]*>\s*(<span class=['\"]Strike(\s*OldWarning)?['\"]>)?\s*([^<]+)\s*(</span>)?\s*</a>(</span>)?[^<]*</td>\s*<td[^<]*>\s*(([^,<]+), )?([^<]+?)(\s*&nbsp;)?\s*</td>\s*<td[^>]*>\s*<a href=['\"][^'\"]*/seek/log\.aspx\?LUID=([a-z0-9-]+)['\"][^>]*>Visit Log</a>\s*</td>\s*</tr>", re.I|re.S)
 # <a href="http://www.geocaching.com/seek/cache_details.aspx?guid=331f0c62-ef78-4ab3-b8d7-be569246771d" class="ImageLink"><img src="http://www.geocaching.com/images/wpttypes/sm/2.gif" title="Traditional Cache" /></a> <a href="http://www.geocaching.com/seek/cache_details.aspx?guid=331f0c62-ef78-4ab3-b8d7-be569246771d">Stepankovi hrosi</a>&nbsp;
 # <a href="http://www.geocaching.com/seek/cache_details.aspx?guid=d3e80a41-4218-4136-bb63-ac0de3ef0b5a" class="ImageLink"><img src="http://www.geocaching.com/images/wpttypes/sm/8.gif" title="Unknown Cache" /></a> <a href="http://www.geocaching.com/seek/cache_details.aspx?guid=d3e80a41-4218-4136-bb63-ac0de3ef0b5a"><span class="Strike">Barva Kouzel</span></a>&nbsp;
@@ -988,10 +2613,14 @@ class MyGeocachingLogs(BaseParser):
         get         --- Parse and return list of user's geocaching logs.
         get_finds   --- Parse and return logs of type: Found it,
                         Webcam Photo Taken, Attended
+        iter_logs   --- Parse and yield user's geocaching logs one by one.
+        iter_finds  --- Parse and yield logs of type: Found it,
+                        Webcam Photo Taken, Attended one by one.
 
     """
 
     _url = "http://www.geocaching.com/my/logs.aspx?s=1"
+    _find_types = ("Found it", "Webcam Photo Taken", "Attended")
 
     def __init__(self):
         self._log = logging.getLogger("gcparser.parser.MyGeocachingLogs")
@@ -999,18 +2628,42 @@ class MyGeocachingLogs(BaseParser):
 
     def get(self, log_types=None):
         """
-        Parse and return list of user's geocaching logs.
+        Parse and return list of user's geocaching logs (the oldest first).
 
         Keyworded arguments:
             log_types       --- If not None return only logs of listed type.
 
+        """
+        logs = list(self.iter_logs(log_types))
+        logs.reverse()
+        return logs
+
+    def get_finds(self):
+        """
+        Parse and return logs of type: Found it, Webcam Photo Taken, Attended
+
+        """
+        return self.get(self._find_types)
+
+    def iter_logs(self, log_types=None):
+        """
+        Parse user's geocaching logs row by row, and yield them as LogItem
+        instances (the newest first, in the order of the webpage).
+
+        Keyworded arguments:
+            log_types       --- If not None yield only logs of listed type.
+
         """
         data = self.http.request(self._url, auth=True)
-        expected_count = len(_pcre("logs_visit").findall(data))
-        self._log.debug("Expecting {0} logs...".format(expected_count))
-        logs = []
-        for log in _pcre("logs_item").findall(data):
-            expected_count -= 1
+        missed = 0
+        for row in _pcre("logs_row").finditer(data):
+            # Match only within the row, no backtracking beyond it.
+            log = _pcre("logs_item").match(data, row.start(), row.end())
+            if log is None:
+                if _pcre("logs_visit").search(data, row.start(), row.end()) is not None:
+                    missed += 1
+                continue
+            log = log.groups("")
 
             log_type = _unescape(log[0]).strip()
             self._log.log_parser("type = {0}".format(log_type))
@@ -1048,18 +2701,17 @@ class MyGeocachingLogs(BaseParser):
             self._log.log_parser("country = {0}".format(cache["country"]))
             self._log.log_parser("province = {0}".format(cache["province"]))
 
-            logs.append(LogItem(log_id, log_type, log_date, cache))
-        if expected_count > 0:
-            self._log.error("Seems like I missed {0} geocaching logs for some reason.".format(expected_count))
-        logs.reverse()
-        return logs
+            yield LogItem(log_id, log_type, log_date, cache)
+        if missed > 0:
+            self._log.error("Seems like I missed {0} geocaching logs for some reason.".format(missed))
 
-    def get_finds(self):
+    def iter_finds(self):
         """
-        Parse and return logs of type: Found it, Webcam Photo Taken, Attended
+        Parse and yield logs of type: Found it, Webcam Photo Taken, Attended
+        (the newest first).
 
         """
-        return self.get(("Found it", "Webcam Photo Taken", "Attended"))
+        return self.iter_logs(self._find_types)
 
 
 
@@ -1101,6 +2753,12 @@ class SeekCache(BaseParser):
     """
     Parse caches in seek query from webpage source.
 
+    Attributes:
+        prefetch    --- Number of result pages loaded in advance in background,
+                        0 to load them only when needed.
+        store       --- SeekStore for keeping the results on disk and resuming
+                        interrupted searches, None to keep them in memory.
+
     Methods:
         coord       --- Parse and return sequence of found caches by coordinates.
         user        --- Parse and return sequence of found caches found by user.
@@ -1111,6 +2769,9 @@ class SeekCache(BaseParser):
 
     _url = "http://www.geocaching.com/seek/nearest.aspx?"
 
+    prefetch = 0
+    store = None
+
     def __init__(self):
         self._log = logging.getLogger("gcparser.parser.SeekCache")
         BaseParser.__init__(self)
@@ -1156,14 +2817,22 @@ class SeekCache(BaseParser):
 
     def get(self, url):
         """
-        Parse and return sequence of found caches on url.
+        Parse and return sequence of found caches on url. With store, an
+        unfinished search for the same url is resumed from the last stored
+        page.
 
         Arguments:
             url         --- URL where to start search.
 
         """
+        if self.store is not None:
+            state = self.store.state(url)
+            if state is not None:
+                count, post_data, loaded = state
+                self._log.info("Resuming search at {0} caches out of {1}.".format(loaded, count))
+                return SeekResult(None, count, url, post_data, self, prefetch=self.prefetch, store=self.store)
         count, caches, post_data = self._get_page(url)
-        return SeekResult(caches, count, url, post_data, self)
+        return SeekResult(caches, count, url, post_data, self, prefetch=self.prefetch, store=self.store)
 
     def _get_page(self, url, post_data=None):
         data = self.http.request(url, data=post_data)
@@ -1294,53 +2963,197 @@ class SeekCacheOCR(SeekCache):
     Improved version of SeekCache, which also parses direction, distance,
     difficulty, terrain and size of caches in the list.
 
+    Attributes:
+        ocr_cache       --- OCRCache with results for the image codes (shared by
+                            the instances with the same data directory), or None.
+        glyph_tolerance --- Maximum number of different pixels for a glyph
+                            without exact match in patterns.
+        image_workers   --- Number of threads downloading the images, the threads
+                            are started on the first download and run until
+                            close.
+        host_downloads  --- Maximum number of concurrent image downloads from
+                            one host (shared by all instances).
+
+    Methods:
+        close           --- Stop image downloading threads and release the
+                            OCR cache.
+
     """
 
+    glyph_tolerance = 2
+    image_workers = 4
+    host_downloads = 2
+    _host_slots = {}
+    _host_lock = threading.Lock()
+    # Glyph index compiled from patterns.txt: (signature => character,
+    # (width, height) => list of (bits, character)).
+    _glyphs = None
+    _glyphs_lock = threading.Lock()
+
     def __init__(self):
         self._log = logging.getLogger("gcparser.parser.SeekCacheOCR")
         self._load_patterns()
+        # Results (or images waiting for recognition) for all seen codes.
+        self._dd = {}
+        self._dts = {}
+        self._images = None
+        self._opener = None
+        self.ocr_cache = None
+        data_dir = self.http.get_data_dir()
+        if data_dir is not None:
+            try:
+                self.ocr_cache = OCRCache.open(os.path.join(data_dir, "ocr.sqlite"))
+            except sqlite3.Error as e:
+                self._log.warn("Could not open OCR cache, images will be always downloaded: {0}".format(e))
         BaseParser.__init__(self)
 
-    def _load_patterns(self):
-        self.patterns = {}
-        with open(os.path.join(os.path.dirname(__file__), "patterns.txt"), "r", encoding="utf-8") as fp:
-            for line in fp.readlines():
-                line = line.strip("\n").split("\t")
-                if len(line) == 2:
-                    pattern = tuple(line[1].split(","))
-                    self.patterns[pattern] = line[0]
+    @classmethod
+    def _load_patterns(cls):
+        """ Compile patterns.txt into the glyph index, once per process. """
+        with cls._glyphs_lock:
+            if cls._glyphs is not None:
+                return
+            exact = {}
+            by_size = defaultdict(list)
+            with open(os.path.join(os.path.dirname(__file__), "patterns.txt"), "r", encoding="utf-8") as fp:
+                for line in fp.readlines():
+                    line = line.strip("\n").split("\t")
+                    if len(line) == 2:
+                        signature = cls._signature(line[1].split(","))
+                        exact[signature] = line[0]
+                        for width, height, bits in [signature] + cls._padded(signature):
+                            by_size[(width, height)].append((bits, line[0]))
+            cls._glyphs = (exact, dict(by_size))
+
+    @staticmethod
+    def _signature(pattern):
+        """ Return (width, height, bits) signature of glyph given as rows of ' ' and 'X'. """
+        width = max([len(row) for row in pattern] + [0])
+        bits = "".join(row.ljust(width) for row in pattern).replace(" ", "0").replace("X", "1")
+        return (width, len(pattern), int(bits or "0", 2))
+
+    @staticmethod
+    def _padded(signature):
+        """ Return signatures of the glyph with an empty row or column added on each side. """
+        width, height, bits = signature
+        rows = [(bits >> (width*(height-1-y))) & ((1 << width) - 1) for y in range(height)]
+        left = 0
+        right = 0
+        for row in rows:
+            left = (left << (width+1)) | row
+            right = (right << (width+1)) | (row << 1)
+        return [(width, height+1, bits), (width, height+1, bits << width), (width+1, height, left), (width+1, height, right)]
 
     def _match_pattern(self, pattern):
-        return self.patterns.get(pattern, None)
+        """ Return character for the glyph bitmask, or None. """
+        signature = self._signature(pattern)
+        exact, by_size = self._glyphs
+        char = exact.get(signature)
+        if char is not None:
+            return char
+        # Nearest glyph by Hamming distance, if it is unambiguous. A stray or
+        # missing pixel on the border changes the size of the glyph, so the
+        # glyphs one row or column smaller (padded in the index) or larger
+        # (padding the glyph) are compared too.
+        best = None
+        best_distance = self.glyph_tolerance + 1
+        for width, height, glyph in [signature] + self._padded(signature):
+            for bits, candidate in by_size.get((width, height), ()):
+                distance = bin(bits ^ glyph).count("1")
+                if distance < best_distance:
+                    best = candidate
+                    best_distance = distance
+                elif distance == best_distance and candidate != best:
+                    best = None
+        if best is not None:
+            self._log.debug("Matched pattern '{0}' with {1} different pixels.".format(best, best_distance))
+        return best
 
     def _process_page(self, data):
-        dd_threads = {}
-        for code in _pcre("seek_dd").findall(data):
-            if code not in dd_threads:
-                url = "http://www.geocaching.com/ImgGen/seek/CacheDir.ashx?k={0}".format(code)
-                thread = ImageDownloader(url, self.http)
-                thread.start()
-                dd_threads[code] = thread
-        dts_threads = {}
-        for code in _pcre("seek_dts").findall(data):
-            if code not in dts_threads:
-                url = "http://www.geocaching.com/ImgGen/seek/CacheInfo.ashx?v={0}".format(code)
-                thread = ImageDownloader(url, self.http)
-                thread.start()
-                dts_threads[code] = thread
+        dd_pending = {}
+        for code in self._uncached("dd", self._dd, _pcre("seek_dd").findall(data)):
+            dd_pending[code] = self._download_image("http://www.geocaching.com/ImgGen/seek/CacheDir.ashx?k={0}".format(code))
+        dts_pending = {}
+        for code in self._uncached("dts", self._dts, _pcre("seek_dts").findall(data)):
+            dts_pending[code] = self._download_image("http://www.geocaching.com/ImgGen/seek/CacheInfo.ashx?v={0}".format(code))
         count = self._parse_count(data)
         post_data = self._parse_post_data(data)
-        self._dd = {}
-        for code in dd_threads:
-            dd_threads[code].join()
-            self._dd[code] = dd_threads[code].image
-        self._dts = {}
-        for code in dts_threads:
-            dts_threads[code].join()
-            self._dts[code] = dts_threads[code].image
+        for code in dd_pending:
+            self._dd[code] = dd_pending[code].result()
+        for code in dts_pending:
+            self._dts[code] = dts_pending[code].result()
         caches = self._parse_caches(data)
+        if self.ocr_cache is not None:
+            self.ocr_cache.commit()
         return count, caches, post_data
 
+    def _uncached(self, kind, results, codes):
+        """ Return list of unique image codes without known result, the results cached on disk are loaded to results. """
+        uncached = []
+        for code in codes:
+            if code not in results and code not in uncached:
+                cached = self._cached(kind, code)
+                if cached is not None:
+                    results[code] = cached
+                else:
+                    uncached.append(code)
+        return uncached
+
+    def _download_image(self, url):
+        """ Queue download of the image, returns PendingRequest with Image instance. """
+        if self._images is None:
+            self._opener = self.http.build_opener()
+            self._images = RequestPool(self.image_workers, self.http)
+        return self._images.submit(self._fetch_image, url)
+
+    def _fetch_image(self, url):
+        """ Download and decode the image, returns Image instance (empty on failure). """
+        with self._host_slot(urllib.parse.urlparse(url).netloc):
+            try:
+                data = self.http.download_url(self._opener, url)
+            except DownloadError:
+                data = bytes()
+        try:
+            return Image.from_data(data)
+        except Exception:
+            return Image()
+
+    @classmethod
+    def _host_slot(cls, host):
+        """ Return semaphore limiting concurrent image downloads from the host. """
+        with cls._host_lock:
+            if host not in cls._host_slots:
+                cls._host_slots[host] = threading.BoundedSemaphore(cls.host_downloads)
+            return cls._host_slots[host]
+
+    def close(self):
+        """
+        Stop image downloading threads and release the OCR cache.
+
+        """
+        if self._images is not None:
+            self._images.close()
+            self._images = None
+        if self.ocr_cache is not None:
+            self.ocr_cache.close()
+            self.ocr_cache = None
+
+    def __del__(self):
+        # Do not leave the image downloading threads behind, if close was not called.
+        if getattr(self, "_images", None) is not None:
+            self._images.close(wait=False)
+
+    def _cached(self, kind, code):
+        """ Return OCR result for the image code from the cache, or None. """
+        if self.ocr_cache is None:
+            return None
+        return self.ocr_cache.get(kind, code)
+
+    def _store(self, kind, code, result):
+        """ Store OCR result for the image code in the cache. """
+        if self.ocr_cache is not None:
+            self.ocr_cache.set(kind, code, result)
+
     def _parse_cache_record(self, data):
         cache = SeekCache._parse_cache_record(self, data)
         match = _pcre("seek_dd").search(data[1])
@@ -1400,6 +3213,7 @@ class SeekCacheOCR(SeekCache):
                 return None
             # Result
             self._dts[code] = (diff, terr, size)
+            self._store("dts", code, self._dts[code])
         return self._dts[code]
 
     def _get_dd(self, code):
@@ -1443,40 +3257,146 @@ class SeekCacheOCR(SeekCache):
                 self._log.debug("Invalid distance value.")
                 return None
             self._dd[code] = (distance, direction)
+            self._store("dd", code, self._dd[code])
         return self._dd[code]
 
 
 class SeekResult(Sequence):
     """
     Sequence wrapper for a result of seek query with lazy loading of next pages.
+    The next pages can be loaded in advance in a background thread, while the
+    current one is consumed. Iterating over the result yields the caches as the
+    pages arrive. With SeekStore, the caches are kept on disk instead of memory.
+
+    Methods:
+        close       --- Stop loading of the pages in background.
 
     """
 
-    def __init__(self, caches, count, url, post_data, parser):
+    _page_size = 20
+
+    def __init__(self, caches, count, url, post_data, parser, prefetch=0, store=None):
         """
         Arguments:
-            caches      --- Initial set of caches.
+            caches      --- Initial set of caches, None to resume the search
+                            stored in store.
             count       --- Total count of caches.
             url         --- URL for future downloads.
             post_data   --- POST data for future downloads.
             parser      --- Parser object.
 
+        Keyworded arguments:
+            prefetch    --- Number of pages loaded in advance in background.
+            store       --- SeekStore keeping the caches, None to keep them
+                            in memory.
+
         """
         self._log = logging.getLogger("gcparser.SeekResult")
         self._count = count
-        self._caches = list(caches)
-        if len(self._caches) not in (self._count, 20):
-            self._log.critical("Seems like I missed some caches in the list, got only {0} caches on first page out of total {1}.".format(len(self._caches), self._count))
         self._url = url
         self._post_data = post_data
         self._parser = parser
-
-    def _load_next_page(self):
+        self._store = store
+        if store is None:
+            self._caches = list(caches)
+            self._loaded = len(self._caches)
+        elif caches is None:
+            self._loaded = store.state(url)[2]
+        else:
+            caches = list(caches)
+            store.begin(url, count, caches, post_data)
+            self._loaded = len(caches)
+        if caches is not None and self._loaded not in (self._count, self._page_size):
+            self._log.critical("Seems like I missed some caches in the list, got only {0} caches on first page out of total {1}.".format(self._loaded, self._count))
+        self._prefetch = prefetch
+        self._exhausted = False
+        self._cond = threading.Condition()
+        self._wanted = 0
+        self._error = None
+        self._closed = False
+        self._running = False
+        self._thread = None
+        if self._prefetch > 0 and self._loaded < self._count:
+            self._running = True
+            self._thread = threading.Thread(target=self._prefetch_pages)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _next_page(self):
+        """ Download and parse the next page, returns list of its caches and POST data for the next one. """
         count, caches, post_data = self._parser._get_page(self._url, self._post_data)
-        if not (len(caches) == 20 or len(caches) + len(self._caches) == self._count):
-            self._log.critical("Seems like I missed some caches in the list, got only {0} caches on this page, total {1} caches out of {2}.".format(len(caches), len(caches)+len(self._caches), self._count))
+        loaded = len(caches) + self._loaded
+        if not (len(caches) == self._page_size or loaded == self._count):
+            self._log.critical("Seems like I missed some caches in the list, got only {0} caches on this page, total {1} caches out of {2}.".format(len(caches), loaded, self._count))
+        if len(caches) == 0:
+            self._log.error("Got empty page of the result, stopping at {0} caches out of {1}.".format(loaded, self._count))
+            self._exhausted = True
+        return caches, post_data
+
+    def _add_page(self, caches, post_data):
+        """ Add the caches of the next page and checkpoint the paging state. """
+        if self._store is None:
+            self._caches.extend(caches)
+        else:
+            self._store.append(self._url, caches, post_data, self._exhausted)
         self._post_data = post_data
-        self._caches.extend(caches)
+        self._loaded += len(caches)
+
+    def _load_next_page(self):
+        """ Load the next page in the calling thread. """
+        self._add_page(*self._next_page())
+
+    def _prefetch_pages(self):
+        """ Load the pages in advance, until everything is loaded or close is called. """
+        while True:
+            with self._cond:
+                while not self._closed and self._loaded >= self._wanted + self._prefetch*self._page_size:
+                    self._cond.wait()
+                if self._closed:
+                    self._running = False
+                    return
+            try:
+                page = self._next_page()
+            except Exception as e:
+                with self._cond:
+                    self._error = e
+                    self._running = False
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._add_page(*page)
+                if self._exhausted or self._loaded >= self._count:
+                    self._running = False
+                self._cond.notify_all()
+                if not self._running:
+                    return
+
+    def _load(self, index):
+        """ Make sure the cache at index is loaded, raises IndexError if the result ended before. """
+        if self._thread is not None:
+            with self._cond:
+                if index >= self._wanted:
+                    self._wanted = index + 1
+                    self._cond.notify_all()
+                while index >= self._loaded and self._running:
+                    self._cond.wait()
+                if index >= self._loaded and self._error is not None:
+                    error = self._error
+                    # Let the next access try again.
+                    self._error = None
+                    self._thread = None
+                    raise error
+        while index >= self._loaded and not self._exhausted:
+            self._load_next_page()
+        if index >= self._loaded:
+            raise IndexError
+
+    def _get(self, index):
+        """ Return already loaded cache at index. """
+        if self._store is None:
+            return self._caches[index]
+        else:
+            return self._store.get(self._url, index)
 
     def __getitem__(self, index):
         if not isinstance(index, int):
@@ -1484,51 +3404,333 @@ class SeekResult(Sequence):
         if index < 0:
             index += len(self)
         if 0 <= index < len(self):
-            while index >= len(self._caches):
-                self._load_next_page()
-            return self._caches[index]
+            self._load(index)
+            return self._get(index)
         else:
             raise IndexError
 
+    def __iter__(self):
+        index = 0
+        while index < len(self):
+            try:
+                self._load(index)
+            except IndexError:
+                return
+            while index < self._loaded:
+                yield self._get(index)
+                index += 1
+
     def __len__(self):
         return self._count
 
+    def close(self):
+        """
+        Stop loading of the pages in background, the rest of them is loaded
+        again only when needed.
+
+        """
+        thread = self._thread
+        if thread is not None:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            thread.join()
+            self._thread = None
+
 
-class ImageDownloader(threading.Thread):
+class SeekStore:
     """
-    Thread for downloading images.
+    SQLite file with caches and paging state of seek results. The caches are
+    stored page by page together with POST data for the next page, so only a
+    few recently read pages are held in memory and an interrupted search can
+    be resumed.
 
     Attributes:
-        data        --- Downloaded data.
-        image       --- Downloaded image as Image instance.
+        max_age     --- Searches not updated for this many seconds are deleted
+                        on opening.
+
+    Methods:
+        state       --- Return paging state of an unfinished search.
+        begin       --- Store the first page of a new search.
+        append      --- Store the next page of a search.
+        get         --- Return a stored cache.
+        delete      --- Delete a stored search.
+        close       --- Close the database.
 
     """
 
-    def __init__(self, url, http):
+    max_age = 7*24*3600
+    _page_size = 20
+    _cached_pages = 4
+
+    def __init__(self, filename):
         """
         Arguments:
-            url     --- URL of the image.
-            http    --- HTTP interface object.
+            filename    --- Path to the SQLite file.
 
         """
-        self.http = http
-        self.url = url
-        self.data = None
-        self.image = None
-        threading.Thread.__init__(self)
-
-    def run(self):
-        opener = self.http.build_opener()
-        self.data = self.http.download_url(opener, self.url)
-        try:
-            self.image = Image.from_data(self.data)
-        except Exception as e:
-            self.image = Image()
+        self._log = logging.getLogger("gcparser.SeekStore")
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS search (
+                    key char(32) NOT NULL,
+                    url text NOT NULL,
+                    count int NOT NULL,
+                    post_data text NOT NULL,
+                    loaded int NOT NULL,
+                    done int(1) NOT NULL,
+                    updated int NOT NULL,
+                    PRIMARY KEY (key))""")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS cache (
+                    key char(32) NOT NULL,
+                    idx int NOT NULL,
+                    data text NOT NULL,
+                    PRIMARY KEY (key, idx))""")
+            old = self._db.execute("SELECT key FROM search WHERE updated < ?", (int(time()) - self.max_age,)).fetchall()
+            for row in old:
+                self._delete(row[0])
+            self._db.commit()
+
+    def _key(self, url):
+        """ Return key of the search. """
+        return md5(url.encode("utf-8")).hexdigest()
+
+    def _delete(self, key):
+        """ Delete the search, the lock must be held. """
+        self._db.execute("DELETE FROM search WHERE key = ?", (key,))
+        self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+        self._forget(key)
+
+    def _forget(self, key):
+        """ Drop the pages of the search from memory, the lock must be held. """
+        for page in [page for page in self._pages if page[0] == key]:
+            del self._pages[page]
+
+    def _insert(self, key, start, caches):
+        """ Insert caches of the search from index start, the lock must be held. """
+        for index, cache in enumerate(caches, start):
+            self._db.execute("INSERT INTO cache(key, idx, data) VALUES(?,?,?)", (key, index, json.dumps(cache)))
+
+    def state(self, url):
+        """
+        Return paging state (count, post_data, loaded) of the unfinished search
+        on url, or None.
+
+        Arguments:
+            url         --- URL of the search.
+
+        """
+        with self._lock:
+            row = self._db.execute("SELECT count, post_data, loaded FROM search WHERE key = ? AND done = 0", (self._key(url),)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2]
+
+    def begin(self, url, count, caches, post_data):
+        """
+        Store the first page of a new search on url, replacing the old one.
+
+        Arguments:
+            url         --- URL of the search.
+            count       --- Total count of caches.
+            caches      --- Caches from the first page.
+            post_data   --- POST data for the next page.
+
+        """
+        key = self._key(url)
+        with self._lock:
+            self._delete(key)
+            self._insert(key, 0, caches)
+            self._db.execute("INSERT INTO search(key, url, count, post_data, loaded, done, updated) VALUES(?,?,?,?,?,?,?)", (key, url, count, json.dumps(post_data), len(caches), int(len(caches) >= count), int(time())))
+            self._db.commit()
+
+    def append(self, url, caches, post_data, exhausted=False):
+        """
+        Store the next page of the search on url.
+
+        Arguments:
+            url         --- URL of the search.
+            caches      --- Caches from the page.
+            post_data   --- POST data for the next page.
+
+        Keyworded arguments:
+            exhausted   --- There are no more pages.
+
+        """
+        key = self._key(url)
+        with self._lock:
+            count, loaded = self._db.execute("SELECT count, loaded FROM search WHERE key = ?", (key,)).fetchone()
+            self._insert(key, loaded, caches)
+            loaded += len(caches)
+            self._db.execute("UPDATE search SET post_data = ?, loaded = ?, done = ?, updated = ? WHERE key = ?", (json.dumps(post_data), loaded, int(exhausted or loaded >= count), int(time()), key))
+            self._db.commit()
+            self._forget(key)
+
+    def get(self, url, index):
+        """
+        Return stored cache of the search on url, raises IndexError if it is
+        not stored.
+
+        Arguments:
+            url         --- URL of the search.
+            index       --- Index of the cache.
+
+        """
+        page = (self._key(url), index // self._page_size)
+        with self._lock:
+            caches = self._pages.pop(page, None)
+            if caches is None:
+                start = page[1] * self._page_size
+                caches = {}
+                for row in self._db.execute("SELECT idx, data FROM cache WHERE key = ? AND idx >= ? AND idx < ?", (page[0], start, start + self._page_size)):
+                    caches[row[0]] = json.loads(row[1])
+                while len(self._pages) >= self._cached_pages:
+                    self._pages.popitem(last=False)
+            self._pages[page] = caches
+        if index not in caches:
+            raise IndexError
+        return caches[index]
+
+    def delete(self, url):
+        """
+        Delete the stored search on url.
+
+        Arguments:
+            url         --- URL of the search.
+
+        """
+        with self._lock:
+            self._delete(self._key(url))
+            self._db.commit()
+
+    def close(self):
+        """
+        Close the database.
+
+        """
+        with self._lock:
+            self._db.close()
+
+
+class OCRCache:
+    """
+    Persistent cache of OCR results of seek images, so every image code is
+    downloaded and recognized only once. Use OCRCache.open to share one
+    connection by all users of the same file.
+
+    Methods:
+        open        --- Return shared OCRCache for the file.
+        get         --- Return OCR result for the image code.
+        set         --- Store OCR result for the image code.
+        commit      --- Write the stored results to the disk.
+        close       --- Close the database, when all its users closed it.
+
+    """
+
+    # Shared instances by filename, and the lock guarding them.
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, filename):
+        """
+        Arguments:
+            filename    --- Path to the SQLite file.
+
+        """
+        self._log = logging.getLogger("gcparser.OCRCache")
+        self._lock = threading.Lock()
+        self._filename = filename
+        self._users = 1
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS ocr (
+                    kind varchar(3) NOT NULL,
+                    code varchar(100) NOT NULL,
+                    result text NOT NULL,
+                    PRIMARY KEY (kind, code))""")
+            self._db.commit()
+
+    @classmethod
+    def open(cls, filename):
+        """
+        Return OCRCache for the file shared by all its users, each of them
+        should call close when done.
+
+        Arguments:
+            filename    --- Path to the SQLite file.
+
+        """
+        with cls._shared_lock:
+            cache = cls._shared.get(filename)
+            if cache is None:
+                cache = cls(filename)
+                cls._shared[filename] = cache
+            else:
+                cache._users += 1
+            return cache
+
+    def get(self, kind, code):
+        """
+        Return OCR result for the image code as tuple, or None.
+
+        Arguments:
+            kind        --- Kind of the image ('dd' or 'dts').
+            code        --- Code of the image.
+
+        """
+        with self._lock:
+            row = self._db.execute("SELECT result FROM ocr WHERE kind = ? AND code = ?", (kind, code)).fetchone()
+        if row is None:
+            return None
+        return tuple(json.loads(row[0]))
+
+    def set(self, kind, code, result):
+        """
+        Store OCR result for the image code, call commit to write it.
+
+        Arguments:
+            kind        --- Kind of the image ('dd' or 'dts').
+            code        --- Code of the image.
+            result      --- Tuple with the result.
+
+        """
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO ocr(kind, code, result) VALUES(?,?,?)", (kind, code, json.dumps(result)))
+
+    def commit(self):
+        """
+        Write the stored results to the disk.
+
+        """
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        """
+        Close the database, when all its users closed it.
+
+        """
+        with self._shared_lock:
+            self._users -= 1
+            if self._users > 0:
+                self.commit()
+                return
+            if self._shared.get(self._filename) is self:
+                del self._shared[self._filename]
+        with self._lock:
+            self._db.commit()
+            self._db.close()
 
 
 class Image:
     """
-    Basic image manipulation.
+    Basic image manipulation. The pixels are stored in a flat RGBA buffer (or
+    a buffer of palette indices for palette images), which is shared by all
+    the images cut from the original one. The emptiness test is evaluated only
+    once for every distinct color and the resulting mask is shared too, so the
+    splits and strips only scan the mask.
 
     Attributes:
         RGBA        --- Namedtuple for representing RGBA colors.
@@ -1559,13 +3761,38 @@ class Image:
             pixels  --- Pixel data.
 
         """
+        data = bytearray()
+        for row in pixels:
+            for px in row:
+                data.extend(px)
         if len(pixels) > 0:
-            self.height = len(pixels)
-            self.width = len(pixels[0])
+            height = len(pixels)
+            width = len(pixels[0])
         else:
-            self.width = 0
-            self.height = 0
-        self.pixels = pixels
+            width = 0
+            height = 0
+        self._view(data, width, 0, 0, width, height, {})
+
+    def _view(self, data, stride, left, top, width, height, masks, palette=None):
+        """ Set the image to a part of the buffer. """
+        # Flat RGBA buffer of the original image (or palette indices with
+        # list of RGBA colors in palette) and its width.
+        self._data = data
+        self._palette = palette
+        self._stride = stride
+        self._left = left
+        self._top = top
+        self.width = width
+        self.height = height
+        # Emptiness function => mask of the buffer (1 for filled pixel).
+        self._masks = masks
+
+    @classmethod
+    def _from_buffer(cls, data, stride, left, top, width, height, masks, palette=None):
+        """ Create image instance from a part of the buffer without copying it. """
+        image = cls.__new__(cls)
+        image._view(data, stride, left, top, width, height, masks, palette)
+        return image
 
     @classmethod
     def from_data(cls, data):
@@ -1586,18 +3813,93 @@ class Image:
         if len(data) == 0:
             return cls()
 
-        reader = png.Reader(bytes=data).asRGBA8()
-        width = reader[0]
-        height = reader[1]
-        pixels = []
-        for rowData in reader[2]:
-            row = []
-            for i in range(0, len(rowData), 4):
-                row.append(cls.RGBA(rowData[i], rowData[i+1], rowData[i+2], rowData[i+3]))
-            pixels.append(row)
-        if len(pixels) != height or len(pixels[-1]) != width:
+        reader = png.Reader(bytes=data)
+        reader.preamble()
+        if reader.colormap:
+            # Keep the palette indices, the masks are then computed from
+            # the palette only.
+            width, height, rows, meta = reader.read()
+            palette = [cls.RGBA(*(tuple(color) + (255,))[0:4]) for color in reader.palette()]
+            planes = 1
+        else:
+            width, height, rows, meta = reader.asRGBA8()
+            palette = None
+            planes = 4
+        pixels = bytearray()
+        for row in rows:
+            pixels.extend(row)
+        if len(pixels) != width*height*planes:
+            raise ValueError("Invalid image data.")
+        if palette is not None and len(pixels) > 0 and max(pixels) >= len(palette):
             raise ValueError("Invalid image data.")
-        return cls(pixels)
+        return cls._from_buffer(pixels, width, 0, 0, width, height, {}, palette)
+
+    @property
+    def pixels(self):
+        """ Pixel data as list of rows with RGBA tuples, copied from the buffer. """
+        pixels = []
+        for y in range(self.height):
+            if self._palette is not None:
+                start = (self._top+y)*self._stride + self._left
+                pixels.append([self._palette[index] for index in self._data[start:start+self.width]])
+            else:
+                start = ((self._top+y)*self._stride + self._left)*4
+                row = self._data[start:start+self.width*4]
+                pixels.append([self.RGBA(*row[i:i+4]) for i in range(0, len(row), 4)])
+        return pixels
+
+    def _mask(self, empty):
+        """ Return mask of the whole buffer for the emptiness function. """
+        mask = self._masks.get(empty)
+        if mask is None and self._palette is not None:
+            table = bytearray(256)
+            for index, color in enumerate(self._palette):
+                table[index] = 0 if empty(color) else 1
+            mask = bytes(self._data).translate(table)
+            self._masks[empty] = mask
+        elif mask is None:
+            colors = struct.unpack("<{0}I".format(len(self._data)//4), bytes(self._data))
+            filled = {}
+            for color in set(colors):
+                filled[color] = 0 if empty(self.RGBA(*struct.pack("<I", color))) else 1
+            # The emptiness usually depends on one channel only (e.g. alpha),
+            # then the mask is just a translation of that channel.
+            for channel in (3, 0, 1, 2):
+                flags = {}
+                for color, flag in filled.items():
+                    if flags.setdefault((color >> 8*channel) & 0xff, flag) != flag:
+                        break
+                else:
+                    table = bytearray(256)
+                    for value, flag in flags.items():
+                        table[value] = flag
+                    mask = bytes(self._data[channel::4]).translate(table)
+                    break
+            else:
+                mask = bytes(map(filled.__getitem__, colors))
+            self._masks[empty] = mask
+        return mask
+
+    def _rows(self, empty):
+        """ Return list of flags, whether the rows contain any filled pixel. """
+        mask = self._mask(empty)
+        rows = []
+        for y in range(self.height):
+            start = (self._top+y)*self._stride + self._left
+            rows.append(mask.find(b"\x01", start, start+self.width) != -1)
+        return rows
+
+    def _columns(self, empty):
+        """ Return list of flags, whether the columns contain any filled pixel. """
+        mask = self._mask(empty)
+        columns = []
+        if self.height == 0:
+            return columns
+        start = self._top*self._stride + self._left
+        end = (self._top+self.height-1)*self._stride + self._left + 1
+        for x in range(self.width):
+            columns.append(b"\x01" in mask[start+x:end+x:self._stride])
+        return columns
 
     def bitmask(self, empty=lambda x: x.a == 0, chars=" X"):
         """
@@ -1609,21 +3911,25 @@ class Image:
             chars       --- Sequence containing characters for empty and filled pixels.
 
         """
-        mask = []
+        mask = self._mask(empty)
+        try:
+            table = bytes.maketrans(b"\x00\x01", "".join(chars[0:2]).encode("ascii"))
+        except (UnicodeEncodeError, ValueError):
+            table = None
+        rows = []
         for y in range(self.height):
-            row = ""
-            for x in range(self.width):
-                px = self.pixels[y][x]
-                if empty(px):
-                    row += chars[0]
-                else:
-                    row += chars[1]
-            mask.append(row)
-        return tuple(mask)
+            start = (self._top+y)*self._stride + self._left
+            row = mask[start:start+self.width]
+            if table is not None:
+                rows.append(row.translate(table).decode("ascii"))
+            else:
+                rows.append("".join(chars[px] for px in row))
+        return tuple(rows)
 
     def cut(self, left, top, right, bottom):
         """
-        Create a new Image instance from a part of the original image.
+        Create a new Image instance from a part of the original image, sharing
+        the pixel data with it.
 
         Arguments:
             left    --- Left border coordinate.
@@ -1632,13 +3938,13 @@ class Image:
             bottom  --- Bottom border coordinate.
 
         """
-        pixels = []
-        for y in range(max(top, 0), min(bottom+1, self.height)):
-            row = []
-            for x in range(max(left, 0), min(right+1, self.width)):
-                row.append(self.pixels[y][x])
-            pixels.append(row)
-        return type(self)(pixels)
+        left = max(left, 0)
+        top = max(top, 0)
+        width = max(min(right+1, self.width) - left, 0)
+        height = max(min(bottom+1, self.height) - top, 0)
+        if height == 0:
+            width = 0
+        return self._from_buffer(self._data, self._stride, self._left+left, self._top+top, width, height, self._masks, self._palette)
 
     def vstrip(self, empty=lambda x: x.a == 0):
         """
@@ -1648,18 +3954,10 @@ class Image:
             empty       --- Function returning True, if the pixel is considered empty.
 
         """
-        top = self.height-1
-        bottom = 0
-        for y in range(self.height):
-            is_empty = True
-            for x in range(self.width):
-                if not empty(self.pixels[y][x]):
-                    is_empty = False
-                    break
-            if not is_empty:
-                top = min(y, top)
-                bottom = max(y, bottom)
-        return self.cut(0, top, self.width-1, bottom)
+        filled = [y for y, row in enumerate(self._rows(empty)) if row]
+        if len(filled) == 0:
+            return self.cut(0, self.height-1, self.width-1, 0)
+        return self.cut(0, filled[0], self.width-1, filled[-1])
 
     def hstrip(self, empty=lambda x: x.a == 0):
         """
@@ -1669,18 +3967,10 @@ class Image:
             empty       --- Function returning True, if the pixel is considered empty.
 
         """
-        left = self.width-1
-        right = 0
-        for x in range(self.width):
-            is_empty = True
-            for y in range(self.height):
-                if not empty(self.pixels[y][x]):
-                    is_empty = False
-                    break
-            if not is_empty:
-                left = min(x, left)
-                right = max(x, right)
-        return self.cut(left, 0, right, self.height-1)
+        filled = [x for x, column in enumerate(self._columns(empty)) if column]
+        if len(filled) == 0:
+            return self.cut(self.width-1, 0, 0, self.height-1)
+        return self.cut(filled[0], 0, filled[-1], self.height-1)
 
     def strip(self, empty=lambda x: x.a == 0):
         """
@@ -1692,6 +3982,21 @@ class Image:
         """
         return self.vstrip(empty=empty).hstrip(empty=empty)
 
+    def _runs(self, flags):
+        """ Return list of (first, last) indices of the runs of True in flags. """
+        runs = []
+        first = None
+        for i, flag in enumerate(flags):
+            if flag:
+                if first is None:
+                    first = i
+            elif first is not None:
+                runs.append((first, i-1))
+                first = None
+        if first is not None:
+            runs.append((first, len(flags)-1))
+        return runs
+
     def vsplit(self, empty=lambda x: x.a == 0):
         """
         Create a sequence of new Image instances from parts of the image separated by
@@ -1701,28 +4006,7 @@ class Image:
             empty       --- Function returning True, if the pixel is considered empty.
 
         """
-        parts = []
-        top = None
-        bottom = None
-        for y in range(self.height):
-            is_empty = True
-            for x in range(self.width):
-                if not empty(self.pixels[y][x]):
-                    is_empty = False
-                    break
-            if not is_empty:
-                if top is None:
-                    top = y
-                    bottom = y
-                else:
-                    bottom = y
-            elif top is not None:
-                parts.append(self.cut(0, top, self.width-1, bottom))
-                top = None
-                bottom = None
-        if top is not None:
-            parts.append(self.cut(0, top, self.width-1, bottom))
-        return parts
+        return [self.cut(0, top, self.width-1, bottom) for top, bottom in self._runs(self._rows(empty))]
 
     def hsplit(self, empty=lambda x: x.a == 0):
         """
@@ -1733,28 +4017,7 @@ class Image:
             empty       --- Function returning True, if the pixel is considered empty.
 
         """
-        parts = []
-        left = None
-        right = None
-        for x in range(self.width):
-            is_empty = True
-            for y in range(self.height):
-                if not empty(self.pixels[y][x]):
-                    is_empty = False
-                    break
-            if not is_empty:
-                if left is None:
-                    left = x
-                    right = x
-                else:
-                    right = x
-            elif left is not None:
-                parts.append(self.cut(left, 0, right, self.height-1))
-                left = None
-                right = None
-        if left is not None:
-            parts.append(self.cut(left, 0, right, self.height-1))
-        return parts
+        return [self.cut(left, 0, right, self.height-1) for left, right in self._runs(self._columns(empty))]
 
 
 ########################################
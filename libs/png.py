@@ -2081,6 +2081,9 @@ class Reader:
         width,height,pixels,meta = get()
         maxval = 2**meta['bitdepth'] - 1
         targetmaxval = 2**targetbitdepth - 1
+        if maxval == targetmaxval:
+            # Nothing to rescale, pass the rows through untouched.
+            return width, height, pixels, meta
         factor = float(targetmaxval) / float(maxval)
         meta['bitdepth'] = targetbitdepth
         def iterscale():
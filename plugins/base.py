@@ -21,6 +21,7 @@
 """
 
 from collections import OrderedDict
+from contextlib import contextmanager
 import logging
 import sqlite3
 
@@ -72,6 +73,22 @@ class Plugin(object):
 
 
 class Storage(object):
+    # Connections shared by all storages of the same database file, and depth of their transactions
+    _connections = {}
+    _depth = {}
+    # Size of sqlite3 cache of prepared statements per connection
+    cachedStatements = 200
+    # PRAGMAs applied to connections, by database file
+    _pragmas = {}
+    # Allowed values of configurable PRAGMAs, int for numbers
+    pragmaValues = {
+        "journal_mode": ("delete", "truncate", "persist", "memory", "wal", "off"),
+        "synchronous": ("off", "normal", "full", "extra", "0", "1", "2", "3"),
+        "temp_store": ("default", "file", "memory", "0", "1", "2"),
+        "cache_size": int,
+        "mmap_size": int,
+        "busy_timeout": int}
+
     def __init__(self, filename, plugin=None):
         if plugin is None:
             self.log = logging.getLogger("Pyggs.db")
@@ -85,13 +102,86 @@ class Storage(object):
 
 
     def getDb(self):
-        """ Return a new DB connection.
+        """ Return DB connection shared by all storages of the same file, do not close it.
         """
-        con = sqlite3.connect(self.filename)
-        con.row_factory = sqlite3.Row
+        con = Storage._connections.get(self.filename)
+        if con is None:
+            con = sqlite3.connect(self.filename, cached_statements=self.cachedStatements)
+            con.row_factory = sqlite3.Row
+            Storage._connections[self.filename] = con
+            Storage._depth[self.filename] = 0
+            self._applyPragmas(con, Storage._pragmas.get(self.filename, {}))
         return con
 
 
+    @classmethod
+    def configure(cls, filename, pragmas):
+        """ Set PRAGMAs (dictionary name: value) for connections to the database file, empty value keeps SQLite default.
+            Applied also to already opened connection.
+        """
+        log = logging.getLogger("Pyggs.db")
+        valid = OrderedDict()
+        for name in sorted(pragmas):
+            value = str(pragmas[name]).strip().lower()
+            if value == "":
+                continue
+            allowed = cls.pragmaValues.get(name)
+            if allowed is None:
+                log.error(_("Unknown database option '{0}', ignoring.").format(name))
+            elif allowed is int and not value.lstrip("-").isdigit():
+                log.error(_("Invalid value '{0}' of database option '{1}', use integer, please.").format(value, name))
+            elif allowed is not int and value not in allowed:
+                log.error(_("Invalid value '{0}' of database option '{1}', use one of: {2}.").format(value, name, ", ".join(allowed)))
+            else:
+                valid[name] = value
+        cls._pragmas[filename] = valid
+        con = cls._connections.get(filename)
+        if con is not None:
+            cls._applyPragmas(con, valid)
+
+
+    @staticmethod
+    def _applyPragmas(con, pragmas):
+        """ Execute validated PRAGMAs on connection.
+        """
+        for name, value in pragmas.items():
+            result = con.execute("PRAGMA {0} = {1}".format(name, value)).fetchone()
+            if name == "journal_mode" and result is not None and result[0].lower() != value:
+                logging.getLogger("Pyggs.db").warn(_("Database journal mode '{0}' is not supported, using '{1}'.").format(value, result[0]))
+        con.commit()
+
+
+    @contextmanager
+    def transaction(self):
+        """ Run the queries in the with block in one transaction, yields cursor.
+            Committed at the end of the outermost transaction, rolled back on exception.
+        """
+        db = self.getDb()
+        Storage._depth[self.filename] += 1
+        success = False
+        try:
+            yield db.cursor()
+            success = True
+        finally:
+            Storage._depth[self.filename] -= 1
+            if Storage._depth[self.filename] == 0:
+                if success:
+                    db.commit()
+                else:
+                    db.rollback()
+
+
+    @classmethod
+    def closeAll(cls):
+        """ Commit and close all shared DB connections.
+        """
+        for con in cls._connections.values():
+            con.commit()
+            con.close()
+        cls._connections.clear()
+        cls._depth.clear()
+
+
     def fetchAssoc(self, result, format="#"):
         """ Fetch result to a dictionary.
         """
@@ -139,9 +229,9 @@ class Storage(object):
         """ Perform query in current database.
         """
         db = self.getDb()
-        result = db.cursor().execute(query, values).fetchall()
-        db.commit()
-        db.close()
+        result = db.execute(query, values).fetchall()
+        if Storage._depth[self.filename] == 0:
+            db.commit()
         return result
 
 
@@ -23,6 +23,7 @@
 __version__ = "0.2.20"
 
 
+from collections import OrderedDict
 import logging
 import math
 import time
@@ -64,12 +65,9 @@ class Plugin(base.Plugin):
         if oldVersion < "0.2.16":
             # fix floating timeouts
             storage = self.master.globalStorage
-            db = storage.getDb()
-            cur = db.cursor()
-            for cache in cur.execute("SELECT guid, lastCheck FROM cache").fetchall():
-                cur.execute("UPDATE cache SET lastCheck = ? WHERE guid = ?", (int(float(cache["lastCheck"])), cache["guid"]))
-            db.commit()
-            db.close()
+            with storage.transaction() as cur:
+                for cache in cur.execute("SELECT guid, lastCheck FROM cache").fetchall():
+                    cur.execute("UPDATE cache SET lastCheck = ? WHERE guid = ?", (int(float(cache["lastCheck"])), cache["guid"]))
         return True
 
 
@@ -121,11 +119,13 @@ class Plugin(base.Plugin):
         self.homecoord["lon"] = float(self.master.config.get("general", "homelon"))
 
         self.master.registerHandler("cache", self.parseCache)
+        self.master.registerHandler("caches", self.parseCaches)
 
 
     def parseCache(self, cache):
         """Update Cache database"""
-        details = dict(cache)
+        # Copy only the stored fields, so the parser does not need to parse the rest
+        details = dict((field, cache[field]) for field in Storage.fields if field in cache)
         if "lat" in details and "lon" in details:
             elevation = self.getElevation(details["lat"], details["lon"])
             if elevation is not None:
@@ -134,6 +134,12 @@ class Plugin(base.Plugin):
         self.storage.update(details)
 
 
+    def parseCaches(self, caches):
+        """Update Cache database by several caches"""
+        for cache in caches:
+            self.parseCache(cache)
+
+
     def distance(self, lat1, lon1, lat2=None, lon2=None):
         """Calculate distance from home coordinates"""
         if lat2 is None:
@@ -153,6 +159,9 @@ class Plugin(base.Plugin):
 
 
 class Storage(base.Storage):
+    # Fields of cache details stored in the database
+    fields = ("guid", "waypoint", "name", "owner", "owner_id", "hidden", "type", "country", "province", "lat", "lon", "difficulty", "terrain", "size", "disabled", "archived", "hint", "attributes", "inventory", "visits")
+
     def createTables(self):
         """Create necessary tables"""
         base.Storage.createTables(self)
@@ -197,57 +206,73 @@ class Storage(base.Storage):
             self.log.error(_("No guid passed, not updating."))
             return
 
-        db = self.getDb()
-        cur = db.cursor()
-
-        cur.execute("DELETE FROM cache_inventory WHERE guid = ?", (data["guid"],))
-        for tbid in data.get("inventory", {}):
-            cur.execute("INSERT INTO cache_inventory(guid, tbid, name) VALUES(?,?,?)", (data["guid"], tbid, data["inventory"][tbid]))
-
-        if len(data.get("visits", [])) > 0:
-            cur.execute("DELETE FROM cache_visits WHERE guid = ?", (data["guid"],))
-            for logtype in data["visits"]:
-                cur.execute("INSERT INTO cache_visits(guid, type, count) VALUES(?,?,?)", (data["guid"], logtype, data["visits"][logtype]))
-
-        old = cur.execute("SELECT * FROM cache WHERE guid=?", (data["guid"],)).fetchone()
-        if old is None:
-            sql = "INSERT INTO cache(guid, waypoint, name, owner, owner_id, hidden, type, country, province, lat, lon, difficulty, terrain, size, disabled, archived, hint, attributes, lastCheck, elevation) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
-            sql_data = (data["guid"], data.get("waypoint", "GC"), data.get("name", ""), data.get("owner", ""), data.get("owner_id", ""), data.get("hidden", ""), data.get("type", ""), data.get("country", ""), data.get("province", ""), data.get("lat", ""), data.get("lon", ""), data.get("difficulty", ""), data.get("terrain", ""), data.get("size", ""), data.get("disabled", ""), data.get("archived", ""), data.get("hint", ""), data.get("attributes", ""), int(time.time()), data.get("elevation", -9999))
-        else:
-            update = {"lastCheck": int(time.time())}
-            for k in ("waypoint", "name", "owner", "owner_id", "hidden", "type", "country", "province", "lat", "lon", "difficulty", "terrain", "size", "disabled", "archived", "hint", "attributes", "elevation"):
-                if k in data:
-                    update[k] = data[k]
-                else:
-                    self.log.debug("{0} not found in downloaded cache details.".format(k))
-            sql = "UPDATE cache SET {0} = ? WHERE guid = ?".format(" = ?, ".join(update.keys()))
-            sql_data = tuple(list(update.values()) + [data["guid"]])
-        self.log.debug(sql)
-        cur.execute(sql, sql_data)
-        db.commit()
-        db.close()
+        with self.transaction() as cur:
+            cur.execute("DELETE FROM cache_inventory WHERE guid = ?", (data["guid"],))
+            for tbid in data.get("inventory", {}):
+                cur.execute("INSERT INTO cache_inventory(guid, tbid, name) VALUES(?,?,?)", (data["guid"], tbid, data["inventory"][tbid]))
+
+            if len(data.get("visits", [])) > 0:
+                cur.execute("DELETE FROM cache_visits WHERE guid = ?", (data["guid"],))
+                for logtype in data["visits"]:
+                    cur.execute("INSERT INTO cache_visits(guid, type, count) VALUES(?,?,?)", (data["guid"], logtype, data["visits"][logtype]))
+
+            old = cur.execute("SELECT * FROM cache WHERE guid=?", (data["guid"],)).fetchone()
+            if old is None:
+                sql = "INSERT INTO cache(guid, waypoint, name, owner, owner_id, hidden, type, country, province, lat, lon, difficulty, terrain, size, disabled, archived, hint, attributes, lastCheck, elevation) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
+                sql_data = (data["guid"], data.get("waypoint", "GC"), data.get("name", ""), data.get("owner", ""), data.get("owner_id", ""), data.get("hidden", ""), data.get("type", ""), data.get("country", ""), data.get("province", ""), data.get("lat", ""), data.get("lon", ""), data.get("difficulty", ""), data.get("terrain", ""), data.get("size", ""), data.get("disabled", ""), data.get("archived", ""), data.get("hint", ""), data.get("attributes", ""), int(time.time()), data.get("elevation", -9999))
+            else:
+                update = {"lastCheck": int(time.time())}
+                for k in ("waypoint", "name", "owner", "owner_id", "hidden", "type", "country", "province", "lat", "lon", "difficulty", "terrain", "size", "disabled", "archived", "hint", "attributes", "elevation"):
+                    if k in data:
+                        update[k] = data[k]
+                    else:
+                        self.log.debug("{0} not found in downloaded cache details.".format(k))
+                sql = "UPDATE cache SET {0} = ? WHERE guid = ?".format(" = ?, ".join(update.keys()))
+                sql_data = tuple(list(update.values()) + [data["guid"]])
+            self.log.debug(sql)
+            cur.execute(sql, sql_data)
 
 
     def getDetails(self, guids):
-        """Selects data from database, performs update if neccessary"""
+        """Selects data from database, performs update if neccessary.
+           Returns list of details in the order of guids, caches without data are left out (and logged as error).
+        """
         timeout = self.plugin.config["timeout"]*24*3600
+        guids = list(guids)
         result = []
-        db = self.getDb()
-        cur = db.cursor()
-        for guid in guids:
-            row = cur.execute("SELECT * FROM cache WHERE guid = ?", (guid,)).fetchone()
-            if row is None or (timeout + int(row["lastCheck"])) <= int(time.time()):
+        cur = self.getDb().cursor()
+        # Load the requested guids to a temporary table (per connection) and join it with the cache tables
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS cache_guids (guid varchar(36) NOT NULL, PRIMARY KEY (guid))")
+        with self.transaction():
+            cur.execute("DELETE FROM cache_guids")
+            cur.executemany("INSERT OR IGNORE INTO cache_guids(guid) VALUES(?)", ((guid,) for guid in guids))
+
+        outdated = set()
+        for row in cur.execute("SELECT g.guid FROM cache_guids g LEFT JOIN cache c ON c.guid = g.guid WHERE c.guid IS NULL OR c.lastCheck + ? <= ?", (timeout, int(time.time()))):
+            outdated.add(row["guid"])
+        if len(outdated) > 0:
+            outdated = [guid for guid in OrderedDict.fromkeys(guids) if guid in outdated]
+            for guid in outdated:
                 self.log.debug("Data about cache guid {0} out of date, initiating refresh.".format(guid))
-                self.plugin.master.parse("cache", guid)
-                row = cur.execute("SELECT * FROM cache WHERE guid = ?", (guid,)).fetchone()
-            row = dict(row)
-            row["inventory"] = {}
-            for inv in cur.execute("SELECT tbid, name FROM cache_inventory WHERE guid = ?", (guid,)).fetchall():
-                row["inventory"][inv["tbid"]] = inv["name"]
-            row["visits"] = {}
-            for vis in cur.execute("SELECT type, count FROM cache_visits WHERE guid = ?", (guid,)).fetchall():
-                row["visits"][vis["type"]] = int(vis["count"])
+            self.plugin.master.parse("caches", outdated, fields=self.fields)
+
+        caches = {}
+        for row in cur.execute("SELECT c.* FROM cache c JOIN cache_guids g ON g.guid = c.guid"):
+            caches[row["guid"]] = dict(row)
+        inventory = {}
+        for row in cur.execute("SELECT i.guid, i.tbid, i.name FROM cache_inventory i JOIN cache_guids g ON g.guid = i.guid"):
+            inventory.setdefault(row["guid"], {})[row["tbid"]] = row["name"]
+        visits = {}
+        for row in cur.execute("SELECT v.guid, v.type, v.count FROM cache_visits v JOIN cache_guids g ON g.guid = v.guid"):
+            visits.setdefault(row["guid"], {})[row["type"]] = int(row["count"])
+
+        for guid in guids:
+            if guid not in caches:
+                self.log.error(_("No data about cache guid {0}, skipping.").format(guid))
+                continue
+            row = dict(caches[guid])
+            row["inventory"] = dict(inventory.get(guid, {}))
+            row["visits"] = dict(visits.get(guid, {}))
             result.append(row)
-        db.close()
 
         return result
@@ -114,33 +114,32 @@ class Storage(base.Storage):
             self.log.debug("Response: {0}".format(result))
             return
 
-        self.query("DROP TABLE gccz_myratings")
-        self.createTables()
-        db = self.getDb()
-        cur = db.cursor()
-        result = result[2].split(":",1)[-1]
-        for row in result.split("|"):
-            row = row.split(";")
-            if len(row) >= 2:
-                cur.execute("INSERT INTO gccz_myratings(waypoint, myrating) VALUES(?,?)", (row[0], row[1]))
+        # Replace the data in one transaction, so the old data are kept on failure
+        with self.transaction() as cur:
+            cur.execute("DELETE FROM gccz_myratings")
+            cur.executemany("INSERT INTO gccz_myratings(waypoint, myrating) VALUES(?,?)", self.parseRows(result[2].split(":",1)[-1]))
         self.log.info(_("Geocaching.cz MyRatings database successfully updated."))
-        db.commit()
-        db.close()
         self.setEnv("lastcheck", int(time.time()))
         self.valid = True
 
 
+    def parseRows(self, data):
+        """Generate database rows from downloaded ratings data"""
+        for row in data.split("|"):
+            row = row.split(";")
+            if len(row) >= 2:
+                yield (row[0], row[1])
+
+
     def getRatings(self, waypoints):
         """Selects data from database, performs update if neccessary"""
         self.checkValidity()
         result = []
-        db = self.getDb()
-        cur = db.cursor()
+        cur = self.getDb().cursor()
         for wpt in waypoints:
             row = cur.execute("SELECT * FROM gccz_myratings WHERE waypoint = ?", (wpt,)).fetchone()
             if row is not None:
                 row = dict(row)
                 result.append(row)
-        db.close()
 
         return result
@@ -62,6 +62,8 @@ class Plugin(base.Plugin):
 
 
 class Storage(base.Storage):
+    _waypoint = re.compile("GC[0-9A-Z]+")
+
     def __init__(self, filename, plugin):
         base.Storage.__init__(self, filename, plugin)
         self.valid = None
@@ -116,33 +118,32 @@ class Storage(base.Storage):
             self.log.debug("Response: {0}".format(result))
             return
 
-        self.query("DROP TABLE gccz_ratings")
-        self.createTables()
-        db = self.getDb()
-        cur = db.cursor()
-        result = result[2].split(":",1)[-1]
-        for row in result.split("|"):
-            row = row.split(";")
-            if re.match("GC[0-9A-Z]+", row[0]):
-                cur.execute("INSERT INTO gccz_ratings(waypoint, rating, count, deviation) VALUES(?,?,?,?)", (row[0], int(row[3]), int(row[2]), int(row[5])))
+        # Replace the data in one transaction, so the old data are kept on failure
+        with self.transaction() as cur:
+            cur.execute("DELETE FROM gccz_ratings")
+            cur.executemany("INSERT INTO gccz_ratings(waypoint, rating, count, deviation) VALUES(?,?,?,?)", self.parseRows(result[2].split(":",1)[-1]))
         self.log.info(_("Geocaching.cz Ratings database successfully updated."))
-        db.commit()
-        db.close()
         self.setEnv("lastcheck", int(time.time()))
         self.valid = True
 
 
+    def parseRows(self, data):
+        """Generate database rows from downloaded ratings data"""
+        for row in data.split("|"):
+            row = row.split(";")
+            if self._waypoint.match(row[0]):
+                yield (row[0], int(row[3]), int(row[2]), int(row[5]))
+
+
     def getRatings(self, waypoints, minCount=0, maxDeviation=100):
         """Selects data from database, performs update if neccessary"""
         self.checkValidity()
         result = []
-        db = self.getDb()
-        cur = db.cursor()
+        cur = self.getDb().cursor()
         for wpt in waypoints:
             row = cur.execute("SELECT * FROM gccz_ratings WHERE waypoint = ? AND count >= ? AND deviation <= ?", (wpt,minCount,maxDeviation)).fetchone()
             if row is not None:
                 row = dict(row)
                 result.append(row)
-        db.close()
 
         return result
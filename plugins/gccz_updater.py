@@ -50,11 +50,16 @@ class Plugin(base.Plugin):
 
 
     def finish(self):
+        myFinds = self.myfinds.storage.select()
+        caches = self.cache.storage.fetchAssoc(self.cache.storage.getDetails([row["guid"] for row in myFinds]), "guid")
         finds = ""
-        for row in self.myfinds.storage.select():
+        for row in myFinds:
+            if row["guid"] not in caches:
+                self.log.error(_("Missing details of cache guid {0}, skipping Geocaching.cz database update.").format(row["guid"]))
+                return
             if len(finds) > 0:
                 finds = finds + "|"
-            details = self.cache.storage.getDetails([row["guid"]])[0]
+            details = caches[row["guid"]]
             finds = finds + "{0};{1};{2};{3}".format(details["waypoint"], row["date"], details["lat"], details["lon"])
 
         hash = str(finds)
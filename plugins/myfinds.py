@@ -20,6 +20,7 @@
     51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 """
 
+import itertools
 import logging
 import time
 
@@ -39,12 +40,15 @@ class Plugin(base.Plugin):
         config.defaults[self.NS] = {}
         config.defaults[self.NS]["timeout"] = "24"
         config.update(self.NS, "timeout", _("My Finds data timeout in hours:"), validate=lambda val: None if val.isdigit() else _("Use only digits, please."))
+        config.defaults[self.NS]["fullsync"] = "7"
+        config.update(self.NS, "fullsync", _("Full My Finds synchronization interval in days:"), validate=lambda val: None if val.isdigit() else _("Use only digits, please."))
 
 
     def onPyggsUpgrade(self, oldVersion):
         # Force update of myFinds database
         self.log.warn(_("New version of Pyggs: forcing database update."))
         self.storage.delEnv("lastcheck")
+        self.storage.delEnv("lastfullsync")
         return True
 
 
@@ -52,20 +56,18 @@ class Plugin(base.Plugin):
         self.storage = Storage(self.master.profileStorage.filename, self)
         base.Plugin.prepare(self)
         self.config["timeout"] = int(self.config["timeout"])
+        self.config["fullsync"] = int(self.config["fullsync"])
         self.master.registerHandler("myFinds", self.parseMyFinds)
 
 
     def parseMyFinds(self, myFinds):
         """Update MyFinds database"""
         self.log.info(_("Updating MyFinds database."))
-        myFinds = list(myFinds)
-        if len(myFinds) == 0:
+        if self.storage.update(myFinds) == 0:
             if self.storage.query("SELECT COUNT(*) FROM myfinds")[0][0] == 0:
                 self.log.critical(_("Got zero myFinds records (bug?) and local databse is empty too."))
             else:
                 self.log.error(_("Got zero myFinds records (bug?), leaving old database in place."))
-        else:
-            self.storage.update(myFinds)
 
 
 
@@ -103,17 +105,59 @@ class Storage(base.Storage):
 
 
     def update(self, data):
-        """Update MyFinds database by data"""
-        self.query("DROP TABLE myfinds")
-        self.createTables()
-        db = self.getDb()
-        cur = db.cursor()
-        for i in range(len(data)):
-            cur.execute("INSERT INTO myfinds(guid, sequence, date, luid) VALUES(?,?,?,?)", (data[i].cache["guid"], i+1, data[i].date, data[i].luid))
-        db.commit()
-        db.close()
+        """Update MyFinds database by data (iterable, the newest find first), returns number of finds read.
+           Between full synchronizations only finds newer than the last known log are read and added.
+           Old data are kept, if there are no finds in data.
+        """
+        # Wait for the first find (i.e. the download) before locking the database
+        data = iter(data)
+        first = next(data, None)
+        if first is None:
+            return 0
+        data = itertools.chain([first], data)
+        lastFullSync = self.getEnv("lastfullsync")
+        fullSync = self.plugin.config["fullsync"]*24*3600
+        if lastFullSync is None or float(lastFullSync)+fullSync < int(time.time()):
+            count = self.updateFull(data)
+        else:
+            count = self.updateIncremental(data)
         self.setEnv("lastcheck", int(time.time()))
         self.valid = True
+        return count
+
+
+    def updateFull(self, data):
+        """Rebuild MyFinds database from all finds in data (iterable, the newest find first)"""
+        self.log.debug("Full MyFinds synchronization.")
+        # Read all finds before locking the database, finds are numbered from the oldest
+        rows = [(find.cache["guid"], find.date, find.luid) for find in data]
+        count = len(rows)
+        with self.transaction() as cur:
+            cur.execute("DELETE FROM myfinds")
+            cur.executemany("INSERT INTO myfinds(guid, sequence, date, luid) VALUES(?,?,?,?)", ((guid, count-i, date, luid) for i, (guid, date, luid) in enumerate(rows)))
+            self.setEnv("lastfullsync", int(time.time()))
+        return count
+
+
+    def updateIncremental(self, data):
+        """Add finds from data (iterable, the newest find first) until the first already known log"""
+        known = set(row["luid"] for row in self.query("SELECT luid FROM myfinds"))
+        if len(known) == 0:
+            return self.updateFull(data)
+        count = 0
+        new = []
+        for find in data:
+            count += 1
+            if find.luid in known:
+                # Stop reading the rest of the (already known) logs
+                break
+            new.append(find)
+        self.log.debug("Incremental MyFinds synchronization, {0} new finds.".format(len(new)))
+        if len(new) > 0:
+            with self.transaction() as cur:
+                sequence = cur.execute("SELECT MAX(sequence) FROM myfinds").fetchone()[0]
+                cur.executemany("INSERT INTO myfinds(guid, sequence, date, luid) VALUES(?,?,?,?)", ((find.cache["guid"], sequence+i, find.date, find.luid) for i, find in enumerate(reversed(new), 1)))
+        return count
 
 
     def select(self, query="SELECT * FROM myfinds"):
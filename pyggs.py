@@ -26,6 +26,7 @@ __version__ = "0.2.25"
 
 from collections import OrderedDict
 import gettext
+import itertools
 import logging
 from optparse import IndentedHelpFormatter
 from optparse import OptionParser
@@ -33,12 +34,13 @@ import os
 import platform
 import re
 from shutil import rmtree
+import signal
 import sys
 import urllib.request
 
 sys.path.insert(0, os.path.join(sys.path[0], "libs"))
 
-from configuration import ProfileConfig
+from configuration import GlobalConfig, ProfileConfig
 from output import Templar, Theme
 import console as console
 import gcparser as gcparser
@@ -63,6 +65,7 @@ class Pyggs(object):
         self.workDir = workDir
         self.profile = profile
         self.config = ProfileConfig(os.path.join(workDir, "pyggs", "profiles", profile, "config.ini"))
+        self.globalConfig = GlobalConfig(os.path.join(workDir, "pyggs", "config.ini"))
         self.plugins = {}
         self.templateDirs = [os.path.join(self.workDir, "pyggs", "templates"), os.path.join(os.path.abspath(os.path.dirname(__file__)), "templates")]
         self.themeDirs = [os.path.join(self.workDir, "pyggs", "themes"), os.path.join(os.path.abspath(os.path.dirname(__file__)), "themes")]
@@ -318,51 +321,90 @@ class Pyggs(object):
         console.writeln(_("Note: You can always edit these setings by running pyggs with --setup (-s) switch."), console.color("G", True, ""))
 
 
+    def configureStorage(self, config, filename):
+        """ Set database options from storage section of config for the database file
+        """
+        options = set(config.defaults.get("storage", {}))
+        if config.has_section("storage"):
+            options.update(config.options("storage"))
+        Storage.configure(filename, dict((option, config.get("storage", option)) for option in options))
+
+
     def run(self):
         """ Run pyggs
         """
         config = self.config
         # Init GCparser, and redefine again self.log
         gcparser.HTTPInterface.set_data_dir(os.path.join(self.workDir, "parser"))
+        gcparser.HTTPInterface.set_cache_size(int(config.get("geocaching.com", "cachesize"))*1024*1024)
         gcparser.HTTPInterface.set_credentials(gcparser.Credentials(config.get("geocaching.com", "username"), password=config.get("geocaching.com", "password")))
 
         self.parsers = {}
         self.parsers["cache"] = gcparser.CacheDetails().get
-        self.parsers["myFinds"] = gcparser.MyGeocachingLogs().get_finds
-        self.parsers["editProfile"] = gcparser.Profile().update
-
-        self.globalStorage = Storage(os.path.join(self.workDir, "pyggs", "storage.sqlite"))
-        self.profileStorage = Storage(os.path.join(self.workDir, "pyggs", "profiles", profile, "storage.sqlite"))
-
-        self.handlers = {}
-        self.pages = {}
-        self.loadPlugins()
-        self.makeDepTree()
-
-        # Prepare plugins
-        for plugin in self.plugins:
-            if hasattr(self.plugins[plugin], "prepare"):
-                self.log.info(_("Preparing plugin {0}...").format(plugin))
-                self.plugins[plugin].prepare()
-
-        # Run plugins
-        for plugin in self.plugins:
-            if hasattr(self.plugins[plugin], "run"):
-                self.log.info(_("Running plugin {0}...").format(plugin))
-                self.plugins[plugin].run()
-
-        # Render output
-        self.outDir = os.path.abspath(os.path.expanduser(self.config.get("output", "directory")))
-        if not os.path.isdir(self.outDir):
-            self.log.critical(_("Invalid ouput directory {0}.").format(self.outDir))
-        templar = Templar(self.getTemplate(), self.getTheme(), self.outDir)
-        templar.outputPages(self.pages)
-
-        # Finish plugins
-        for plugin in self.plugins:
-            if hasattr(self.plugins[plugin], "finish"):
-                self.log.info(_("Finishing plugin {0}...").format(plugin))
-                self.plugins[plugin].finish()
+        cacheDetails = gcparser.CacheDetails()
+        cacheDetails.processes = int(config.get("geocaching.com", "processes")) or None
+        # Fork the parsing processes before any download threads are started
+        cacheDetails.start()
+        try:
+            self.parsers["caches"] = cacheDetails.get_many
+            self.parsers["myFinds"] = gcparser.MyGeocachingLogs().iter_finds
+            self.parsers["editProfile"] = gcparser.Profile().update
+
+            globalFile = os.path.join(self.workDir, "pyggs", "storage.sqlite")
+            profileFile = os.path.join(self.workDir, "pyggs", "profiles", profile, "storage.sqlite")
+            self.configureStorage(self.globalConfig, globalFile)
+            self.configureStorage(self.config, profileFile)
+            self.globalStorage = Storage(globalFile)
+            self.profileStorage = Storage(profileFile)
+
+            self.handlers = {}
+            self.pages = {}
+            self.loadPlugins()
+            self.makeDepTree()
+
+            # Prepare plugins
+            for plugin in self.plugins:
+                if hasattr(self.plugins[plugin], "prepare"):
+                    self.log.info(_("Preparing plugin {0}...").format(plugin))
+                    self.plugins[plugin].prepare()
+
+            # Run plugins
+            for plugin in self.plugins:
+                if hasattr(self.plugins[plugin], "run"):
+                    self.log.info(_("Running plugin {0}...").format(plugin))
+                    self.plugins[plugin].run()
+
+            # Render output
+            self.outDir = os.path.abspath(os.path.expanduser(self.config.get("output", "directory")))
+            if not os.path.isdir(self.outDir):
+                self.log.critical(_("Invalid ouput directory {0}.").format(self.outDir))
+            templar = Templar(self.getTemplate(), self.getTheme(), self.outDir)
+            templar.outputPages(self.pages)
+
+            # Finish plugins
+            for plugin in self.plugins:
+                if hasattr(self.plugins[plugin], "finish"):
+                    self.log.info(_("Finishing plugin {0}...").format(plugin))
+                    self.plugins[plugin].finish()
+
+            self.writeMetrics()
+        finally:
+            # Stop the parsing processes and close the databases also when a plugin fails
+            cacheDetails.close()
+            Storage.closeAll()
+
+
+    def writeMetrics(self):
+        """ Write summary of HTTP request metrics into profile directory
+        """
+        metrics = gcparser.HTTPInterface.metrics
+        summary = metrics.summary()
+        self.log.info(_("Downloaded {0} pages ({1} kB) in {2:.0f} seconds, {3:.0f} seconds spent waiting.").format(summary["count"], summary["bytes"]//1024, summary["transfer"], summary["wait"]))
+        filename = os.path.join(self.workDir, "pyggs", "profiles", self.profile, "metrics.json")
+        try:
+            metrics.write(filename)
+        except IOError:
+            self.log.error(_("Could not write request metrics to {0}.").format(filename))
 
 
     def registerPage(self, output, template, menutemplate, context, layout=True):
@@ -383,11 +425,23 @@ class Pyggs(object):
 
     def parse(self, name, *args, **kwargs):
         """ Create parser and return it to every registered handler.
+            Lazy results (iterators) are passed on lazily, each handler gets its own copy.
         """
         handlers = self.handlers.get(name)
         if handlers is not None:
-            result = self.parsers[name](*args, **kwargs)
-            for handler in handlers:
+            try:
+                result = self.parsers[name](*args, **kwargs)
+                if hasattr(result, "__next__"):
+                    # Generators download the data on the first item, so get it here
+                    result = itertools.chain(list(itertools.islice(result, 1)), result)
+            except gcparser.DownloadError as e:
+                self.log.error(_("Download failed, keeping stored data: {0}").format(e))
+                return
+            if hasattr(result, "__next__"):
+                results = itertools.tee(result, len(handlers))
+            else:
+                results = [result] * len(handlers)
+            for handler, result in zip(handlers, results):
                 handler(result)
 
 
@@ -513,14 +567,26 @@ class Pyggs(object):
 
     def fetch(self, url, data=None, timeout=20):
         self.log.debug("Downloading {0}".format(url))
+        metrics = gcparser.HTTPInterface.metrics
+        metrics.begin(url)
         try:
             if data is not None:
                 data = urllib.parse.urlencode(data).encode("utf-8")
-            response = urllib.request.urlopen(url, data=data, timeout=timeout)
+            handlers = [gcparser.KeepAliveHandler(gcparser.HTTPInterface.pool, metrics), gcparser.DecompressHandler]
+            if gcparser.HTTPInterface.cache is not None:
+                handlers.append(gcparser.CacheHandler(gcparser.HTTPInterface.cache))
+            if gcparser.HTTPInterface.fixtures is not None:
+                handlers.extend(gcparser.HTTPInterface.fixtures.handlers())
+            opener = urllib.request.build_opener(*handlers)
+            response = opener.open(url, data=data, timeout=timeout)
             responseData = response.read()
+            metrics.add("size", len(responseData))
         except IOError:
+            metrics.add("errors", 1)
             self.log.error(_("Could not fetch URL {0}.").format(url))
             return None
+        finally:
+            metrics.end()
         if response.getcode() != 200:
             self.log.error(_("Got error code {0} while fetching {1}.").format(response.getcode(), url))
             return None
@@ -545,6 +611,8 @@ if __name__ == "__main__":
     optp.add_option("-v", "--verbose", help=_("set logging to INFO"), dest="loglevel", action="store_const", const=logging.INFO)
     optp.add_option("-d", "--debug", help=_("set logging to DEBUG"), dest="loglevel", action="store_const", const=logging.DEBUG)
     optp.add_option("-D", "--Debug", help=_("set logging to ALL"), dest="loglevel", action="store_const", const=0)
+    optp.add_option("--record", help=_("record all downloaded data to a directory"), dest="record", default=None)
+    optp.add_option("--replay", help=_("replay recorded data from a directory instead of downloading"), dest="replay", default=None)
 
     opts,args = optp.parse_args()
     rootlog.setLevel(opts.loglevel)
@@ -562,6 +630,14 @@ if __name__ == "__main__":
     if version < minVersion:
         rootlog.critical(_("You need at least Python {0} to run this script.").format(minVersion))
 
+    # Write buffered cookies and download stats before we get killed
+    def terminate(signum, frame):
+        gcparser.HTTPInterface.flush()
+        raise SystemExit(128 + signum)
+    for signame in ("SIGTERM", "SIGHUP"):
+        if hasattr(signal, signame):
+            signal.signal(getattr(signal, signame), terminate)
+
     workDir = os.path.expanduser(opts.workdir)
     parserDir = os.path.join(workDir, "parser")
     pyggsDir = os.path.join(workDir, "pyggs")
@@ -638,6 +714,11 @@ if __name__ == "__main__":
             with open(os.path.join(profilesDir, profile, "version"), "w") as fp:
                 fp.write(__version__)
 
+    if opts.replay is not None:
+        gcparser.HTTPInterface.set_fixtures(opts.replay, "replay")
+    elif opts.record is not None:
+        gcparser.HTTPInterface.set_fixtures(opts.record, "record")
+
     pyggs = Pyggs(workDir, profile)
     if setup == "full":
         pyggs.fullSetup()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_myfinds.py - tests of myFinds storage synchronization.
+    Copyright (C) 2009-2011 Petr Morávek
+
+    This file is part of Pyggs.
+
+    Pyggs is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    Pyggs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import builtins
+import logging
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "libs"))
+if not hasattr(builtins, "_"):
+    builtins._ = lambda message: message
+
+from plugins import base, myfinds
+
+
+class Find(object):
+    def __init__(self, number):
+        self.cache = {"guid":"guid{0}".format(number)}
+        self.date = "2010-01-01"
+        self.luid = "luid{0}".format(number)
+
+
+class Plugin(object):
+    NS = "plug.myfinds"
+    config = {"timeout":24, "fullsync":7}
+    log = logging.getLogger("Pyggs.plug.myfinds")
+
+
+class TestMyFindsSync(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.storage = myfinds.Storage(os.path.join(self.dir, "storage.sqlite"), Plugin())
+        self.read = []
+
+    def tearDown(self):
+        base.Storage.closeAll()
+        shutil.rmtree(self.dir)
+
+    def parser(self, count):
+        """Yield finds like the logs parser, the newest first, remember the read ones"""
+        for number in range(count, 0, -1):
+            self.read.append(number)
+            yield Find(number)
+
+    def sequences(self):
+        return [(row["luid"], row["sequence"]) for row in self.storage.query("SELECT luid, sequence FROM myfinds ORDER BY sequence")]
+
+    def testFullSync(self):
+        self.assertEqual(self.storage.update(self.parser(5)), 5)
+        self.assertEqual(self.sequences(), [("luid{0}".format(i), i) for i in range(1, 6)])
+
+    def testIncrementalSyncStopsAtKnownLog(self):
+        self.storage.update(self.parser(100))
+        self.read = []
+        self.assertEqual(self.storage.update(self.parser(103)), 4)
+        # Parser is not asked for any log after the newest known one
+        self.assertEqual(self.read, [103, 102, 101, 100])
+        self.assertEqual(self.sequences()[-4:], [("luid100", 100), ("luid101", 101), ("luid102", 102), ("luid103", 103)])
+
+    def testExpiredFullSyncReadsAll(self):
+        self.storage.update(self.parser(10))
+        self.storage.setEnv("lastfullsync", 0)
+        self.read = []
+        self.assertEqual(self.storage.update(self.parser(8)), 8)
+        self.assertEqual(len(self.read), 8)
+        self.assertEqual(len(self.sequences()), 8)
+
+    def testEmptyDataKeepsDatabase(self):
+        self.storage.update(self.parser(3))
+        self.assertEqual(self.storage.update(iter([])), 0)
+        self.assertEqual(len(self.sequences()), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+    tools/bench_cache_details.py - benchmark of cache details extraction.
+    Copyright (C) 2009-2011 Petr Morávek
+
+    This file is part of Pyggs.
+
+    Pyggs is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    Pyggs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    Usage: python3 tools/bench_cache_details.py [-r REVISION] [DIRECTORY]
+
+    Times CacheDetails._parse on the saved cache pages from DIRECTORY (files
+    named <guid or waypoint>.html), or on synthetic pages built from the page
+    snippets documented next to the regexps. With -r, the parser from that
+    git revision is timed too and the results of both are compared.
+"""
+
+import json
+import os.path
+import random
+from optparse import OptionParser
+
+import benchlib
+import gcparser
+
+
+def noise(count):
+    """Return count random pieces of irrelevant markup"""
+    parts = []
+    for i in range(count):
+        parts.append(random.choice([
+            '<div class="x{0}">text {0}</div>\n'.format(i),
+            '<span class="s">abc</span>',
+            '<img src="/images/a{0}.gif" alt="x" />'.format(i),
+            '<p>para gc{0}</p>\n'.format(i),
+            '<strong>bold</strong>',
+            '<a href="/x">link</a> by <a href="/y">y</a>',
+            '<meta name="x" content="y" />',
+            'lorem ipsum dolor sit amet ' * 3]))
+    return "".join(parts)
+
+
+def pm_page(number):
+    """Return synthetic page of Premium Members only cache"""
+    core = """<img src="/x.gif" alt="Premium Members only" /> The owner of <strong> PM cache {0}</strong> has chosen to make this cache listing visible to Premium Members only.
+<span id="ctl00_ContentBody_uxCacheType">A cache by Owner{0}</span>
+ <img src="/images/icons/container/regular.gif" alt="Size: Regular" />
+<strong><span id="ctl00_ContentBody_lblDifficulty">Difficulty:</span></strong> <img src="/s.gif" alt="1.5 out of 5" />
+<strong><span id="ctl00_ContentBody_lblTerrain">Terrain:</span></strong> <img src="/s.gif" alt="2 out of 5" />
+<img id="ctl00_ContentBody_uxWptTypeImage" src="http://www.geocaching.com/images/wpttypes/2.gif" style="border-width:0px" />""".format(number)
+    return noise(200) + "GCAB{0}\n".format(number) + core + noise(300)
+
+
+def page(number, inventory=True):
+    """Return synthetic cache page"""
+    logs = {"data":[{"Visited":"10/{0}/2010".format(i % 28 + 1), "LogGuid":"g{0}".format(i), "LogType":"Found it", "UserName":"u{0}".format(i), "AccountGuid":"a{0}".format(i), "LogText":"<p>Nice cache {0}</p>".format(i) * 5} for i in range(40)]}
+    head = '<meta name="description" content="Cache {0} (GCAB{0}) was created by Owner on 12/23/2003. It&#39;s a Regular size geocache, with difficulty of 2, terrain of 2.5. It&#39;s located in Hlavni mesto Praha, Czech Republic. Blah." />\n'.format(number)
+    body = """<a href="/about/cache_types.aspx" title="About Cache Types"><img src="/images/WptTypes/8.gif" alt="Unknown Cache" width="32" height="32" /></a>
+by <a href="http://www.geocaching.com/profile/?guid=ed7a2040-3bbb-485b-9b03-21ae8507d2d7&wid=92322d1b-d354-4190-980e-8964d7740161&ds=2">Owner</a>
+<p class="OldWarning"><strong>Cache Issues:</strong></p><ul class="OldWarning"><li>This cache is temporarily unavailable. Read the logs.</li></ul>
+<span class="favorite-value">8</span>
+<span id="uxLatLon" style="font-weight:bold;">N 49° 06.592 E 016° 27.837</span>
+""" + noise(150) + """<div class="UserSuppliedContent">
+<span id="ctl00_ContentBody_ShortDescription">Short <b>desc</b></span>
+</div>
+""" + noise(100) + """<div class="UserSuppliedContent">
+<span id="ctl00_ContentBody_LongDescription">Long <p>desc</p> text """ + "blah " * 500 + """</span>
+</div>
+<p>
+</p>
+<p>""" + noise(100) + """<div id="div_hint" class="HalfLeft">
+                Hint<br>text
+</div>
+Attributes</h3>
+<div class="WidgetBody">
+	<img src="/images/attributes/wheelchair-no.gif" alt="not wheelchair accessible" title="not wheelchair accessible" width="30" height="30" /> <img src="/images/attributes/attribute-blank.gif" alt="blank" title="blank" width="30" height="30" /> <p class="NoBottomSpacing"><small><a href="/about/icons.aspx" title="What are Attributes?">What are Attributes?</a></small></p>
+</div>
+"""
+    if inventory:
+        body += """    <span id="ctl00_ContentBody_uxTravelBugList_uxInventoryLabel">Inventory</span>
+</h3>
+<div class="WidgetBody">
+    <ul>
+    <li>
+        <a href="http://www.geocaching.com/track/details.aspx?guid=0eac9e5f-dc6c-4ec3-b1b7-4663245982ef" class="lnk">
+            <img src="http://www.geocaching.com/images/wpttypes/sm/21.gif" width="16" /><span>Bob the Bug</span></a>
+    </li>
+    </ul>
+"""
+    body += """<span id="ctl00_ContentBody_lblFindCounts"><p><img src="/images/icons/icon_smile.gif" alt="Found it" />113&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;<img src="/images/icons/icon_note.gif" alt="Write note" />19&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;</p></span>
+""" + noise(200) + "//<![CDATA[\ninitalLogs = " + json.dumps(logs) + ";\n//]]>\n" + noise(100)
+    return noise(50) + head + body
+
+
+def synthetic_corpus(count=60):
+    """Return list of (page, id) pairs, 10% PM only, one third without inventory"""
+    random.seed(1)
+    corpus = []
+    for number in range(count):
+        if number % 10 == 0:
+            data = pm_page(number)
+        else:
+            data = page(number, inventory=number % 3 != 0)
+        if number % 2:
+            id_ = "GCAB{0}".format(number)
+        else:
+            id_ = "0eac9e5f-dc6c-4ec3-b1b7-4663245982e{0}".format(number % 10)
+        corpus.append((data, id_))
+    return corpus
+
+
+def saved_corpus(directory):
+    """Return list of (page, id) pairs from saved pages"""
+    corpus = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".html"):
+            with open(os.path.join(directory, filename), encoding="utf-8") as fp:
+                corpus.append((fp.read(), filename[:-5]))
+    return corpus
+
+
+def main():
+    optp = OptionParser(usage="%prog [-r REVISION] [DIRECTORY]")
+    optp.add_option("-r", "--revision", help="compare with gcparser from git revision", dest="revision", default=None)
+    optp.add_option("-n", "--repeat", help="number of runs, the best one is reported", dest="repeat", type="int", default=5)
+    opts, args = optp.parse_args()
+
+    if args:
+        corpus = saved_corpus(args[0])
+    else:
+        corpus = synthetic_corpus()
+    if not corpus:
+        optp.error("No pages to parse.")
+    print("{0} pages, {1} kB on average".format(len(corpus), sum(len(data) for data, id_ in corpus) // len(corpus) // 1024))
+
+    modules = [("current", gcparser)]
+    if opts.revision is not None:
+        modules.insert(0, (opts.revision, benchlib.load_gcparser(opts.revision)))
+    results = []
+    for name, module in modules:
+        parser = module.CacheDetails()
+        results.append([parser._parse(data, id_) for data, id_ in corpus])
+        elapsed = benchlib.best_of(lambda: [parser._parse(data, id_) for data, id_ in corpus], opts.repeat)
+        print("{0}: {1:.2f} ms/page".format(name, elapsed / len(corpus) * 1000))
+    if len(results) > 1:
+        print("identical results: {0}".format(results[0] == results[1]))
+
+
+if __name__ == "__main__":
+    main()
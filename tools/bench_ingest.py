@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+    tools/bench_ingest.py - benchmark of the bulk database refreshes.
+    Copyright (C) 2009-2011 Petr Morávek
+
+    This file is part of Pyggs.
+
+    Pyggs is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    Pyggs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    Usage: python3 tools/bench_ingest.py [-r REVISION] [-d DIRECTORY]
+
+    Measures rows per second of the geocaching.cz ratings and myratings
+    refreshes (from a synthetic API response) and of the full My Finds
+    synchronization. With -r, the storages of the plugins from that git
+    revision are measured too. Use -d to put the databases on the filesystem
+    of the profile.
+"""
+
+import os.path
+import random
+import shutil
+import tempfile
+from optparse import OptionParser
+
+import benchlib
+from plugins import base, gccz_myratings, gccz_ratings, myfinds
+
+
+class Master(object):
+    def __init__(self, response):
+        self.response = response
+
+    def fetch(self, url, data=None):
+        return self.response
+
+
+class Plugin(object):
+    config = {"timeout":24, "fullsync":7, "username":"user", "password":"password"}
+
+    def __init__(self, name, response=None):
+        self.NS = "plug." + name
+        self.master = Master(response)
+        # Credentials of the gccz plugin
+        self.gccz = self
+
+
+class Find(object):
+    def __init__(self, number, count):
+        self.cache = {"guid":"{0:036d}".format(number * 7919 % count)}
+        self.date = "2010-01-01"
+        self.luid = "luid{0}".format(number)
+
+
+def waypoints(count):
+    """Return list of count unique random waypoints"""
+    random.seed(1)
+    result = set()
+    while len(result) < count:
+        result.add("GC" + "".join(random.choice("0123456789ABCDEFGHJKMNPQRTVWXYZ") for i in range(5)))
+    return sorted(result, key=lambda waypoint: random.random())
+
+
+def response(rows):
+    """Return geocaching.cz API response with rows"""
+    return "info:ok\nversion:1\ndata:{0}".format("|".join(rows)).encode("utf-8")
+
+
+def main():
+    optp = OptionParser(usage="%prog [-r REVISION] [-d DIRECTORY]")
+    optp.add_option("-r", "--revision", help="compare with plugins from git revision", dest="revision", default=None)
+    optp.add_option("-d", "--directory", help="directory for the databases, temporary by default", dest="directory", default=None)
+    optp.add_option("-n", "--count", help="number of rated caches, a fifth of it is found", dest="count", type="int", default=100000)
+    opts, args = optp.parse_args()
+
+    wpts = waypoints(opts.count)
+    ratings = response("{0};x;{1};{2};y;{3}".format(waypoint, random.randint(1, 99), random.randint(0, 100), random.randint(0, 50)) for waypoint in wpts)
+    myRatings = response("{0};{1}".format(waypoint, random.randint(1, 5)) for waypoint in wpts)
+    finds = [Find(number, opts.count // 5) for number in range(opts.count // 5)]
+
+    versions = [("current", (gccz_ratings, gccz_myratings, myfinds))]
+    if opts.revision is not None:
+        modules = tuple(benchlib.load_revision("plugins/{0}.py".format(module.__name__.split(".")[-1]), opts.revision, module.__name__ + "_revision", package="plugins") for module in versions[0][1])
+        versions.insert(0, (opts.revision, modules))
+    directory = tempfile.mkdtemp(dir=opts.directory)
+    try:
+        for number, (name, (ratingsModule, myRatingsModule, myFindsModule)) in enumerate(versions):
+            filename = os.path.join(directory, "{0}.sqlite".format(number))
+            myFindsStorage = myFindsModule.Storage(filename, Plugin("myfinds"))
+            tests = [
+                ("gccz_ratings", len(wpts), ratingsModule.Storage(filename, Plugin("gccz_ratings", ratings)).update),
+                ("gccz_myratings", len(wpts), myRatingsModule.Storage(filename, Plugin("gccz_myratings", myRatings)).update),
+                ("myfinds", len(finds), lambda: myFindsStorage.updateFull(finds))]
+            try:
+                for test, count, function in tests:
+                    elapsed = benchlib.best_of(function, 1)
+                    print("{0}: {1} {2} rows, {3:.0f} rows/s".format(name, test, count, count / elapsed))
+            finally:
+                base.Storage.closeAll()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+    tools/bench_ocr.py - benchmark of OCR of the seek page images.
+    Copyright (C) 2009-2011 Petr Morávek
+
+    This file is part of Pyggs.
+
+    Pyggs is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    Pyggs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    Usage: python3 tools/bench_ocr.py [-r REVISION] [-p] [DIRECTORY]
+
+    Times decoding and OCR of the difficulty/terrain/size (CacheInfo) and
+    distance/direction (CacheDir) images. DIRECTORY may contain saved images
+    named dts*.png and dd*.png, otherwise synthetic images rendered from
+    libs/patterns.txt are used. With -r, SeekCacheOCR from that git revision
+    is timed too and the results of both are compared. With -p, the images
+    are converted to palette PNGs first.
+"""
+
+import io
+import os.path
+import random
+from optparse import OptionParser
+
+import benchlib
+import gcparser
+import png
+
+
+def load_patterns():
+    """Return dict of OCR patterns as lists of rows"""
+    patterns = {}
+    with open(os.path.join(benchlib.ROOT, "libs", "patterns.txt"), encoding="utf-8") as fp:
+        for line in fp:
+            line = line.rstrip("\n").split("\t")
+            if len(line) == 2:
+                patterns[line[0]] = line[1].split(",")
+    return patterns
+
+
+def render(patterns, width, height, lines):
+    """Render lines of (bottom, left, tokens, color) into RGBA PNG with some noise"""
+    image = [[(255, 255, 255, 0)] * width for y in range(height)]
+    for y in range(height):
+        for x in range(width):
+            if random.random() < 0.03:
+                image[y][x] = (200, 200, 200, random.randint(1, 99))
+    for bottom, x, tokens, color in lines:
+        for token in tokens:
+            pattern = patterns[token]
+            for dy, row in enumerate(pattern):
+                for dx, char in enumerate(row):
+                    if char == "X":
+                        image[bottom - len(pattern) + 1 + dy][x + dx] = color
+            x += max(len(row) for row in pattern) + 1
+    output = io.BytesIO()
+    png.Writer(width, height, alpha=True).write(output, [[sample for pixel in row for sample in pixel] for row in image])
+    return output.getvalue()
+
+
+def synthetic_images(count=40):
+    """Return lists of synthetic dts and dd images"""
+    random.seed(3)
+    patterns = load_patterns()
+    black = (0, 0, 0, 255)
+    sizes = ["Regular", "Small", "Micro", "Large", "Other", "Virtual", "Not chosen"]
+    dts = []
+    for i in range(count):
+        tokens = list(random.choice(["1", "1.5", "2", "3.5", "5"])) + ["/"] + list(random.choice(["1", "2.5", "4"]))
+        dts.append(render(patterns, 70, 24, [(10, 1, tokens, black), (20, 1, [random.choice(sizes)], (230, 20, 20, 255))]))
+    dd = []
+    for i in range(count):
+        direction = random.choice([["N"], ["N", "E"], ["S", "W"], ["W"]])
+        distance = random.choice([["0", ".", "3", "m", "i"], ["1", "2", "0", "ft"], ["H", "e", "r", "e"]])
+        dd.append(render(patterns, 40, 24, [(8, 0, ["."], black), (8, 6, direction, black), (20, 1, distance, black)]))
+    return dts, dd
+
+
+def saved_images(directory):
+    """Return lists of saved dts and dd images"""
+    images = {"dts":[], "dd":[]}
+    for filename in sorted(os.listdir(directory)):
+        for kind in ("dts", "dd"):
+            if filename.startswith(kind) and filename.endswith(".png"):
+                with open(os.path.join(directory, filename), "rb") as fp:
+                    images[kind].append(fp.read())
+    return images["dts"], images["dd"]
+
+
+def to_palette(data):
+    """Convert PNG image to palette PNG with the same colors"""
+    width, height, rows, meta = png.Reader(bytes=data).asRGBA8()
+    rows = [[tuple(row[i:i+4]) for i in range(0, len(row), 4)] for row in rows]
+    palette = sorted(set(pixel for row in rows for pixel in row))
+    index = dict((color, i) for i, color in enumerate(palette))
+    output = io.BytesIO()
+    png.Writer(width, height, palette=palette, bitdepth=8).write(output, [[index[pixel] for pixel in row] for row in rows])
+    return output.getvalue()
+
+
+def recognize(module, dts, dd):
+    """Return OCR results of decoded images"""
+    parser = module.SeekCacheOCR()
+    results = []
+    for code, image in enumerate(dts):
+        parser._dts = {code:image}
+        results.append(parser._get_dts(code))
+    for code, image in enumerate(dd):
+        parser._dd = {code:image}
+        results.append(parser._get_dd(code))
+    return results
+
+
+def decode(module, images):
+    """Return list of decoded images"""
+    return [module.Image.from_data(data) for data in images]
+
+
+def main():
+    optp = OptionParser(usage="%prog [-r REVISION] [-p] [DIRECTORY]")
+    optp.add_option("-r", "--revision", help="compare with gcparser from git revision", dest="revision", default=None)
+    optp.add_option("-n", "--repeat", help="number of runs, the best one is reported", dest="repeat", type="int", default=5)
+    optp.add_option("-p", "--palette", help="convert the images to palette PNGs", dest="palette", action="store_true", default=False)
+    opts, args = optp.parse_args()
+
+    if args:
+        dts, dd = saved_images(args[0])
+    else:
+        dts, dd = synthetic_images()
+    if opts.palette:
+        dts = [to_palette(data) for data in dts]
+        dd = [to_palette(data) for data in dd]
+    count = len(dts) + len(dd)
+    if not count:
+        optp.error("No images to recognize.")
+    print("{0} dts and {1} dd images{2}".format(len(dts), len(dd), opts.palette and ", converted to palette" or ""))
+
+    modules = [("current", gcparser)]
+    if opts.revision is not None:
+        modules.insert(0, (opts.revision, benchlib.load_gcparser(opts.revision)))
+    results = []
+    for name, module in modules:
+        results.append(recognize(module, decode(module, dts), decode(module, dd)))
+        total = benchlib.best_of(lambda: recognize(module, decode(module, dts), decode(module, dd)), opts.repeat)
+        ocr = None
+        for i in range(opts.repeat):
+            dts_images, dd_images = decode(module, dts), decode(module, dd)
+            elapsed = benchlib.best_of(lambda: recognize(module, dts_images, dd_images), 1)
+            if ocr is None or elapsed < ocr:
+                ocr = elapsed
+        print("{0}: decode + OCR {1:.2f} ms/image, OCR only {2:.2f} ms/image".format(name, total / count * 1000, ocr / count * 1000))
+    if len(results) > 1:
+        print("identical results: {0}".format(results[0] == results[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+    tools/bench_storage.py - benchmark of the database PRAGMAs.
+    Copyright (C) 2009-2011 Petr Morávek
+
+    This file is part of Pyggs.
+
+    Pyggs is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    Pyggs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    Usage: python3 tools/bench_storage.py [-d DIRECTORY] [-c CONFIG] [-o NAME=VALUE ...]
+
+    Times a cache refresh (one transaction per updated cache, like parsing of
+    the downloaded cache pages) and rendering (getDetails of all caches) of
+    the cache plugin storage. It is run with the SQLite defaults, with the
+    [storage] section of CONFIG (the built-in defaults when not given) and
+    with WAL journal on top of it. Options given by -o are run as one more
+    setup. Use -d to put the databases on the filesystem of the profile.
+"""
+
+import os.path
+import shutil
+import tempfile
+from optparse import OptionParser
+
+import benchlib
+from configuration import GlobalConfig
+from plugins import base, cache
+
+
+class Master(object):
+    def parse(self, name, *args, **kwargs):
+        pass
+
+
+class Plugin(object):
+    NS = "plug.cache"
+    config = {"timeout":14}
+    master = Master()
+
+
+def run(directory, name, pragmas, count, repeat):
+    """Refresh and render count caches in database with pragmas, print the times"""
+    filename = os.path.join(directory, "{0}.sqlite".format(name))
+    base.Storage.configure(filename, pragmas)
+    storage = cache.Storage(filename, Plugin())
+    guids = ["guid{0}".format(i) for i in range(count)]
+    try:
+        def refresh():
+            for i, guid in enumerate(guids):
+                storage.update({"guid":guid, "waypoint":"GC{0}".format(i), "name":"Cache {0}".format(i), "lat":50.0, "lon":14.0, "inventory":{"tb{0}".format(i):"Travel Bug"}, "visits":{"Found it":3, "Write note":1}})
+        refreshed = benchlib.best_of(refresh, 1)
+        rendered = benchlib.best_of(lambda: storage.getDetails(guids), repeat)
+    finally:
+        base.Storage.closeAll()
+    print("{0}: refresh {1:.2f} ms/cache, render {2:.3f} ms/cache".format(name, refreshed / count * 1000, rendered / count * 1000))
+
+
+def main():
+    optp = OptionParser(usage="%prog [-d DIRECTORY] [-c CONFIG] [-o NAME=VALUE ...]")
+    optp.add_option("-d", "--directory", help="directory for the databases, temporary by default", dest="directory", default=None)
+    optp.add_option("-c", "--config", help="read PRAGMAs from [storage] section of config file", dest="config", default="")
+    optp.add_option("-o", "--option", help="PRAGMA of additional setup", dest="options", action="append", default=[])
+    optp.add_option("-n", "--count", help="number of caches", dest="count", type="int", default=2000)
+    optp.add_option("-r", "--repeat", help="number of renders, the best one is reported", dest="repeat", type="int", default=5)
+    opts, args = optp.parse_args()
+
+    config = GlobalConfig(os.path.expanduser(opts.config))
+    configured = dict((option, config.get("storage", option)) for option in config.defaults["storage"])
+    setups = [("sqlite", {}), ("configured", configured), ("wal", dict(configured, journal_mode="wal", synchronous="normal"))]
+    if opts.options:
+        custom = dict(configured)
+        for option in opts.options:
+            if "=" not in option:
+                optp.error("Use NAME=VALUE for option '{0}'.".format(option))
+            name, value = option.split("=", 1)
+            custom[name.strip()] = value
+        setups.append(("custom", custom))
+
+    directory = tempfile.mkdtemp(dir=opts.directory)
+    try:
+        for name, pragmas in setups:
+            print("{0}: {1}".format(name, ", ".join("{0}={1}".format(*item) for item in sorted(pragmas.items())) or "SQLite defaults"))
+            run(directory, name, pragmas, opts.count, opts.repeat)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+    tools/benchlib.py - shared helpers of the benchmark scripts.
+    Copyright (C) 2009-2011 Petr Morávek
+
+    This file is part of Pyggs.
+
+    Pyggs is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    Pyggs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import builtins
+import logging
+import os.path
+import subprocess
+import sys
+import time
+import types
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "libs"))
+if not hasattr(builtins, "_"):
+    builtins._ = lambda message: message
+logging.basicConfig(level=logging.ERROR)
+
+
+def load_revision(path, revision, name, package=None):
+    """Load module from path (relative to the repository) as it was in git revision"""
+    source = subprocess.check_output(["git", "show", "{0}:{1}".format(revision, path)], cwd=ROOT)
+    module = types.ModuleType(name)
+    module.__file__ = os.path.join(ROOT, path)
+    if package is not None:
+        module.__package__ = package
+    exec(compile(source, "{0}:{1}".format(revision, path), "exec"), module.__dict__)
+    return module
+
+
+def load_gcparser(revision):
+    """Load gcparser together with png from git revision"""
+    png = sys.modules.get("png")
+    sys.modules["png"] = load_revision("libs/png.py", revision, "png")
+    try:
+        return load_revision("libs/gcparser.py", revision, "gcparser")
+    finally:
+        if png is None:
+            del sys.modules["png"]
+        else:
+            sys.modules["png"] = png
+
+
+def best_of(function, repeat=5):
+    """Return the best time of repeat calls of function in seconds"""
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best